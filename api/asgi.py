@@ -0,0 +1,312 @@
+import asyncio
+import io
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from django.db import IntegrityError, close_old_connections
+
+from rest_framework.exceptions import APIException
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from api.auth import AgentKeyAuthentication
+from api.middleware import WBITS, DecompressedStream
+from api.validation import accept_events, bulk_status, insert_accepted
+from logs.buffer import start_spool_replay
+from logs.ingestion import ingestion_setting, insert_events
+
+logger = logging.getLogger(__name__)
+
+AUTHENTICATORS = [JWTAuthentication(), AgentKeyAuthentication()]
+
+
+class HTTPError(Exception):
+    def __init__(self, status, detail, headers=None):
+        self.status = status
+        self.detail = detail
+        self.headers = headers or []
+
+
+def authenticate(authorization):
+    """Return the user or agent of the Authorization header if it can add events"""
+    request = SimpleNamespace(META={'HTTP_AUTHORIZATION': authorization})
+    try:
+        for authenticator in AUTHENTICATORS:
+            result = authenticator.authenticate(request)
+            if result is not None:
+                user = result[0]
+                if not user.has_perm('logs.add_event'):
+                    raise HTTPError(403, 'You do not have permission to perform this action.')
+                return user
+    finally:
+        close_old_connections()
+
+    raise HTTPError(401, 'Authentication credentials were not provided.')
+
+
+def accept(items, user):
+    try:
+        return accept_events(enumerate(items), user)
+    finally:
+        close_old_connections()
+
+
+def inflate(body, encoding):
+    stream = DecompressedStream(io.BytesIO(body), WBITS[encoding], ingestion_setting('MAX_DECOMPRESSED_SIZE'))
+    return stream.read()
+
+
+def write(requests):
+    """Insert the (index, event) items of all requests with one batched write.
+
+    If a deleted agent or user fails the batch, each request is inserted on
+    its own, as the bulk route does. Returns the errors of each request, or
+    the exception its insert raised.
+    """
+    try:
+        try:
+            insert_events([event for items in requests for index, event in items])
+            return [[] for items in requests]
+        except IntegrityError:
+            pass
+
+        results = []
+        for items in requests:
+            for index, event in items:
+                event.pk = None  # Set by the insert that was rolled back
+            try:
+                results.append(insert_accepted(items)[1])
+            except Exception as exc:
+                results.append(exc)
+        return results
+    finally:
+        close_old_connections()
+
+
+class EventBatcher:
+    """Group the events of concurrent requests into batched inserts.
+
+    Batches are written by `executor` once they reach `batch_size` events
+    or `flush_interval` seconds after their first event. At most
+    `max_pending` events wait to be written.
+    """
+
+    def __init__(self, executor, batch_size, flush_interval, max_pending):
+        self.executor = executor
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self.batch = []
+        self.waiters = []
+        self.size = 0
+        self.pending = 0
+        self.timer = None
+
+    async def insert(self, events):
+        """Wait until the (index, event) items are inserted.
+
+        Returns the errors of the events that could not be inserted.
+        """
+        if not events:
+            return []
+        if self.pending + len(events) > self.max_pending:
+            retry_after = str(max(1, round(self.flush_interval)))
+            raise HTTPError(
+                429, 'Too many events waiting to be written.',
+                [(b'retry-after', retry_after.encode())]
+            )
+
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+        self.batch.append(events)
+        self.waiters.append(done)
+        self.size += len(events)
+        self.pending += len(events)
+
+        if self.size >= self.batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.flush_interval, self.flush)
+
+        return await done
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.batch:
+            return None
+
+        batch, waiters, size = self.batch, self.waiters, self.size
+        self.batch, self.waiters, self.size = [], [], 0
+
+        loop = asyncio.get_running_loop()
+        written = loop.run_in_executor(self.executor, write, batch)
+
+        def notify(future):
+            self.pending -= size
+            exception = future.exception()
+            results = [exception] * len(waiters) if exception else future.result()
+            for waiter, result in zip(waiters, results):
+                if waiter.done():
+                    continue
+                if isinstance(result, Exception):
+                    waiter.set_exception(result)
+                else:
+                    waiter.set_result(result)
+
+        written.add_done_callback(notify)
+        return written
+
+
+class EventIngestionApplication:
+    """ASGI application creating events without a worker thread per request.
+
+    It answers POST requests with a JSON event or list of events as the bulk
+    route does, gzip or deflate encoded or not. The body is received on the
+    event loop, while the authentication, validation and inserts, which use
+    the database, run in a bounded thread pool. Inserts of concurrent
+    requests are batched. Idempotency-Key headers are rejected, as responses
+    are not stored.
+    """
+
+    def __init__(self, workers=None, batch_size=None, flush_interval=None, max_pending=None):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or ingestion_setting('ASYNC_WORKERS'),
+            thread_name_prefix='ingestion'
+        )
+        self.batcher = EventBatcher(
+            self.executor,
+            batch_size or ingestion_setting('BUFFER_BATCH_SIZE'),
+            flush_interval or ingestion_setting('ASYNC_FLUSH_INTERVAL'),
+            max_pending or ingestion_setting('BUFFER_SIZE')
+        )
+
+    async def __call__(self, scope, receive, send):
+        try:
+            if scope['method'] != 'POST':
+                raise HTTPError(405, f'Method "{scope["method"]}" not allowed.', [(b'allow', b'POST')])
+            status, data = await self.handle(scope, receive)
+            headers = []
+        except HTTPError as exc:
+            status, data, headers = exc.status, {'detail': exc.detail}, exc.headers
+        except APIException as exc:
+            data = exc.detail if isinstance(exc.detail, dict) else {'detail': exc.detail}
+            status, headers = exc.status_code, []
+            if exc.status_code == 401:
+                headers.append((b'www-authenticate', b'Bearer realm="api"'))
+        except Exception:
+            logger.exception('Could not create the events of %s', scope['path'])
+            status, data, headers = 500, {'detail': APIException.default_detail}, []
+
+        body = json.dumps(data, cls=JSONEncoder).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                *headers
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def handle(self, scope, receive):
+        headers = dict(scope['headers'])
+        loop = asyncio.get_running_loop()
+
+        if b'idempotency-key' in headers:
+            raise HTTPError(400, 'Idempotency-Key is not supported by this route, use /api/events/bulk/.')
+
+        authorization = headers.get(b'authorization', b'').decode('latin-1')
+        user = await loop.run_in_executor(self.executor, authenticate, authorization)
+
+        items = await self.read_events(receive, headers)
+        events, errors, sampled = await loop.run_in_executor(
+            self.executor, accept, items, user
+        )
+        insert_errors = await self.batcher.insert(events)
+        if insert_errors:
+            errors = sorted(errors + insert_errors, key=lambda error: error['index'])
+
+        created = len(events) - len(insert_errors)
+        data = {
+            'created': created, 'rejected': len(errors),
+            'sampled': sampled, 'errors': errors
+        }
+        return bulk_status(created, len(errors)), data
+
+    async def read_events(self, receive, headers):
+        content_type = headers.get(b'content-type', b'').split(b';')[0].strip()
+        if content_type != b'application/json':
+            raise HTTPError(415, f'Unsupported media type "{content_type.decode()}" in request.')
+        encoding = headers.get(b'content-encoding', b'identity').decode('latin-1').strip().lower()
+        if encoding != 'identity' and encoding not in WBITS:
+            raise HTTPError(415, f'Unsupported content encoding "{encoding}" in request.')
+
+        limit = ingestion_setting('MAX_DECOMPRESSED_SIZE')
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise HTTPError(400, 'Client disconnected.')
+            body += message.get('body', b'')
+            if len(body) > limit:
+                raise HTTPError(413, 'Request body is too large.')
+            if not message.get('more_body'):
+                break
+
+        if encoding in WBITS:
+            loop = asyncio.get_running_loop()
+            body = await loop.run_in_executor(self.executor, inflate, bytes(body), encoding)
+
+        try:
+            data = json.loads(bytes(body))
+        except ValueError as exc:
+            raise HTTPError(400, f'JSON parse error - {exc}')
+
+        items = [data] if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            raise HTTPError(400, 'Expected an event or a list of events.')
+
+        max_size = ingestion_setting('BULK_MAX_SIZE')
+        if len(items) > max_size:
+            raise HTTPError(400, f'Ensure this list has no more than {max_size} events.')
+        return items
+
+    async def shutdown(self):
+        written = self.batcher.flush()
+        if written is not None:
+            await written
+        self.executor.shutdown(wait=True)
+
+
+class IngestionRouter:
+    """Send requests to `path` to the ingestion application, others to Django"""
+
+    def __init__(self, django_application, ingestion_application, path):
+        self.django_application = django_application
+        self.ingestion_application = ingestion_application
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['path'] == self.path:
+            await self.ingestion_application(scope, receive, send)
+        else:
+            await self.django_application(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                start_spool_replay()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.ingestion_application.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -1,10 +1,15 @@
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 
-from logs.models import User
+from logs.cache import TTLCache
+from logs.models import AgentKey, User, hash_agent_key
 
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
@@ -43,3 +48,68 @@ class JWTAuthByQueryParams(JWTAuthentication):
 
         validated_token = self.get_validated_token(raw_token)
         return self.get_user(validated_token), validated_token
+
+
+# hashed key -> agent id, or None for unknown and revoked keys
+agent_keys_cache = TTLCache(maxsize=10000, ttl=300)
+
+
+@receiver([post_save, post_delete], sender=AgentKey)
+def invalidate_agent_key(sender, instance, **kwargs):
+    agent_keys_cache.pop(instance.hashed_key)
+
+
+class AgentPrincipal:
+    """User of requests authenticated by an agent key; can only add events"""
+    is_active = True
+    is_anonymous = False
+    is_authenticated = True
+    is_staff = False
+    is_superuser = False
+    permissions = {'logs.add_event'}
+
+    def __init__(self, agent_id):
+        self.agent_id = agent_id
+
+    def has_perm(self, perm, obj=None):
+        return perm in self.permissions
+
+    def has_perms(self, perm_list, obj=None):
+        return all(self.has_perm(perm, obj) for perm in perm_list)
+
+    def __str__(self):
+        return f'agent {self.agent_id}'
+
+
+def key_agent(user):
+    """Id of the agent authenticating as user with its key, else None"""
+    return user.agent_id if isinstance(user, AgentPrincipal) else None
+
+
+class AgentKeyAuthentication(BaseAuthentication):
+    """Authenticate requests with the header 'Authorization: Agent <key>'"""
+    keyword = 'Agent'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].decode().lower() != self.keyword.lower():
+            return None
+
+        if len(auth) != 2:
+            raise AuthenticationFailed('Invalid agent key header.')
+
+        hashed_key = hash_agent_key(auth[1].decode(errors='replace'))
+        agent_id = agent_keys_cache.get(hashed_key, default=False)
+        if agent_id is False:
+            agent_id = AgentKey.objects.filter(
+                hashed_key=hashed_key, is_active=True
+            ).values_list('agent_id', flat=True).first()
+            agent_keys_cache.set(hashed_key, agent_id)
+
+        if agent_id is None:
+            raise AuthenticationFailed('Invalid agent key.')
+
+        return AgentPrincipal(agent_id), hashed_key
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -1,26 +1,103 @@
+from django.db.models import Count
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import SearchFilter
 from django_filters import rest_framework as filters
 
-from logs.models import Event
+from logs.models import Agent, Event, EventGroup, EventRollup
+from logs.search import full_text_search, substring_search
 
 
 class EventFilterClass(filters.FilterSet):
     environment = filters.ChoiceFilter(
-        choices=[(e, e) for e in ['production', 'testing', 'development']],
+        choices=Agent.ENV_CHOICES,
         label='Environment',
         field_name='agent__environment'
     )
 
     class Meta:
         model = Event
-        fields = ['environment', 'archived']
+        fields = ['environment', 'archived', 'fingerprint']
+
+
+class EventGroupFilterClass(filters.FilterSet):
+    environment = filters.ChoiceFilter(
+        choices=Agent.ENV_CHOICES,
+        label='Environment',
+        field_name='agent__environment'
+    )
+
+    class Meta:
+        model = EventGroup
+        fields = ['environment', 'level', 'agent']
+
+
+class EventRollupFilterClass(filters.FilterSet):
+    since = filters.IsoDateTimeFilter(field_name='bucket', lookup_expr='gte', label='Since')
+    until = filters.IsoDateTimeFilter(field_name='bucket', lookup_expr='lt', label='Until')
+    environment = filters.ChoiceFilter(
+        choices=Agent.ENV_CHOICES,
+        label='Environment'
+    )
+
+    class Meta:
+        model = EventRollup
+        fields = ['since', 'until', 'environment', 'level', 'agent']
 
 
 class EventSearchFilter(SearchFilter):
+    def filter_queryset(self, request, queryset, view):
+        search_by = request.query_params.get('search_by')
+        if search_by == 'text':
+            # Words of description and details, from the full-text index
+            return full_text_search(queryset, self.get_search_terms(request))
+        elif search_by in ('description', 'source'):
+            # Parts of words, from the trigram indexes
+            field = 'agent__name' if search_by == 'source' else search_by
+            return substring_search(queryset, field, self.get_search_terms(request))
+        return super().filter_queryset(request, queryset, view)
+
     def get_search_fields(self, view, request):
         search_by = request.query_params.get('search_by')
-        if search_by in ('level', 'description'):
+        if search_by == 'level':
             return [search_by]
-        elif search_by == 'source':
-            return['agent__name']
         return super().get_search_fields(view, request)
+
+
+# Facets of the events list and the lookups they count
+EVENT_FACETS = {
+    'level': 'level',
+    'environment': 'agent__environment',
+    'agent': 'agent',
+}
+
+
+def facet_names(value):
+    """Facets asked in a `facets` query param"""
+    names = [name for name in value.split(',') if name]
+    unknown = set(names) - set(EVENT_FACETS)
+    if unknown:
+        raise ValidationError({'facets': f'Unknown facets: {", ".join(sorted(unknown))}.'})
+    return list(dict.fromkeys(names))
+
+
+def facet_counts(queryset, names):
+    """Events of queryset per value of each facet, from a single GROUP BY"""
+    if not names:
+        return {}  # values() without columns would group by every column
+
+    lookups = [EVENT_FACETS[name] for name in names]
+    groups = queryset.order_by().values(*lookups).annotate(count=Count('id'))
+
+    counts = {name: {} for name in names}
+    for group in groups:
+        for name, lookup in zip(names, lookups):
+            value = group[lookup]
+            counts[name][value] = counts[name].get(value, 0) + group['count']
+
+    return {
+        name: [
+            {'value': value, 'count': count}
+            for value, count in sorted(values.items(), key=lambda item: (-item[1], str(item[0])))
+        ]
+        for name, values in counts.items()
+    }
@@ -0,0 +1,123 @@
+import functools
+import json
+from datetime import timedelta
+
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from django.db import IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+
+from logs.cache import TTLCache
+from logs.ingestion import ingestion_setting
+from logs.models import IdempotencyKey
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+
+# (owner, key) -> (status code, body) of recently completed requests, so
+# most retries are answered without querying the database
+recent_responses = TTLCache(maxsize=10000, ttl=300)
+
+
+class RequestInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this Idempotency-Key is still in progress.'
+    default_code = 'request_in_progress'
+
+
+def key_owner(user):
+    """Scope keys by caller, so clients can not replay each other's responses"""
+    agent_id = getattr(user, 'agent_id', None)
+    if agent_id is not None:
+        return f'agent:{agent_id}'
+    return f'user:{user.pk}'
+
+
+def replay(status_code, body):
+    return Response(
+        json.loads(body), status=status_code, headers={'Idempotent-Replayed': 'true'}
+    )
+
+
+def stored_response(owner, key):
+    stored = recent_responses.get((owner, key))
+    if stored:
+        return stored
+
+    record = IdempotencyKey.objects.filter(
+        owner=owner, key=key, expires_at__gt=timezone.now()
+    ).exclude(status_code=None, locked_until__lte=timezone.now()).first()
+    if record and record.status_code:
+        stored = (record.status_code, record.response)
+        recent_responses.set((owner, key), stored)
+        return stored
+
+    if record:
+        raise RequestInProgress()
+    return None
+
+
+def reserve(owner, key):
+    """Insert a pending row for the key, which is unique per owner.
+
+    Expired rows, and pending rows whose lock expired, are replaced.
+    Raises RequestInProgress if a concurrent request inserted it first.
+    """
+    now = timezone.now()
+    IdempotencyKey.objects.filter(owner=owner, key=key).filter(
+        Q(expires_at__lte=now) | Q(status_code=None, locked_until__lte=now)
+    ).delete()
+    expires_at = now + timedelta(seconds=ingestion_setting('IDEMPOTENCY_TTL'))
+    locked_until = now + timedelta(seconds=ingestion_setting('IDEMPOTENCY_LOCK_TIMEOUT'))
+    try:
+        return IdempotencyKey.objects.create(
+            owner=owner, key=key, expires_at=expires_at, locked_until=locked_until
+        )
+    except IntegrityError:
+        raise RequestInProgress()
+
+
+def idempotent(method):
+    """Store the response of requests with an Idempotency-Key header.
+
+    Retries with the same key return the stored response instead of
+    creating the events again. Throttled and failed requests are not stored,
+    so they can be retried with the same key.
+    """
+    @functools.wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(HEADER)
+        if not key:
+            return method(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            raise ValidationError({
+                'Idempotency-Key': f'Ensure this header has no more than {MAX_KEY_LENGTH} characters.'
+            })
+
+        owner = key_owner(request.user)
+        stored = stored_response(owner, key)
+        if stored:
+            return replay(*stored)
+
+        record = reserve(owner, key)
+        try:
+            response = method(self, request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+
+        if response.status_code == status.HTTP_429_TOO_MANY_REQUESTS or response.status_code >= 500:
+            record.delete()
+            return response
+
+        # Updated by pk: if the lock expired a retry may have replaced the row
+        stored = (response.status_code, json.dumps(response.data, cls=JSONEncoder))
+        IdempotencyKey.objects.filter(pk=record.pk).update(status_code=stored[0], response=stored[1])
+        recent_responses.set((owner, key), stored)
+        return response
+
+    return wrapper
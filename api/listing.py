@@ -0,0 +1,94 @@
+from rest_framework import serializers
+from rest_framework.response import Response
+from rest_framework.settings import ISO_8601, api_settings
+
+# Fields rendering the values read from the database unchanged
+PLAIN_FIELDS = (
+    serializers.BooleanField, serializers.CharField, serializers.ChoiceField,
+    serializers.IntegerField, serializers.IPAddressField,
+    serializers.PrimaryKeyRelatedField, serializers.ReadOnlyField,
+)
+
+
+def iso_datetimes(values, timezone):
+    """DateTimeField representations of values, converted to timezone"""
+    formatted = []
+    for value in values:
+        if value is None:
+            formatted.append(None)
+            continue
+        if timezone is not None:
+            value = value.astimezone(timezone)
+        value = value.isoformat()
+        formatted.append(value[:-6] + 'Z' if value.endswith('+00:00') else value)
+    return formatted
+
+
+def column_formatter(field):
+    """Function rendering a list of values as field renders each of them"""
+    if isinstance(field, serializers.DateTimeField):
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        if output_format is not None and output_format.lower() == ISO_8601:
+            timezone = getattr(field, 'timezone', field.default_timezone())
+            return lambda values: iso_datetimes(values, timezone)
+    elif isinstance(field, PLAIN_FIELDS):
+        return None
+
+    return lambda values: [
+        None if value is None else field.to_representation(value) for value in values
+    ]
+
+
+def readable_fields(serializer):
+    return [(name, field) for name, field in serializer.fields.items() if not field.write_only]
+
+
+def values_rows(queryset, serializer, columns):
+    """values() of queryset with the columns rendered by serializer.
+
+    `columns` maps the fields of the serializer to the lookups holding their
+    values. The columns of the ordering and the primary key are read too, for
+    keyset pagination.
+    """
+    opts = queryset.model._meta
+    lookups = [columns[name] for name, field in readable_fields(serializer)]
+    for key in [*queryset.query.order_by, opts.pk.name]:
+        if isinstance(key, str):
+            name = key.lstrip('-')
+            field = opts.pk if name == 'pk' else opts.get_field(name)
+            lookups.append(field.attname)
+    return queryset.values(*dict.fromkeys(lookups))
+
+
+def render_rows(rows, serializer, columns):
+    """Render values() rows in the JSON of serializer, a column at a time"""
+    fields = readable_fields(serializer)
+    rendered = []
+    for name, field in fields:
+        values = [row[columns[name]] for row in rows]
+        formatter = column_formatter(field)
+        rendered.append(formatter(values) if formatter else values)
+
+    names = [name for name, field in fields]
+    if not names:
+        return [{} for row in rows]
+    return [dict(zip(names, values)) for values in zip(*rendered)]
+
+
+class ValuesListModelMixin:
+    """List a queryset read with values(), without building model instances.
+
+    The response is the same as ListModelMixin's, as long as `values_columns`
+    maps every field of the serializer to the lookup of its value.
+    """
+    values_columns = None
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer()
+        rows = values_rows(queryset, serializer, self.values_columns)
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(render_rows(page, serializer, self.values_columns))
+        return Response(render_rows(rows, serializer, self.values_columns))
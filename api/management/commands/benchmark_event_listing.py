@@ -0,0 +1,76 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.listing import render_rows, values_rows
+from api.serializers import AgentModelSerializer, EventModelSerializer
+from api.views import AgentAPIViewSet, EventAPIViewSet
+from logs.ingestion import insert_events
+from logs.models import Agent, Event, LEVELS
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the rows per second of the events and agents lists rendered '
+        'by their model serializers and from values(). The events are created '
+        'in a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=10000)
+        parser.add_argument('--agents', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def create(self, options):
+        agents = Agent.objects.bulk_create([
+            Agent(name=f'benchmark agent {i}', environment='testing', address='10.0.0.1')
+            for i in range(options['agents'])
+        ])
+        now = timezone.now()
+        insert_events([
+            Event(
+                level=LEVELS[i % len(LEVELS)], description=f'Benchmark event {i}',
+                details='Traceback (most recent call last): ...',
+                datetime=now, agent=agents[i % len(agents)]
+            )
+            for i in range(options['events'])
+        ])
+
+    def compare(self, name, queryset, serializer, columns, repeat):
+        def models():
+            return serializer.__class__(queryset.all(), many=True).data
+
+        def values():
+            return render_rows(list(values_rows(queryset.all(), serializer, columns)), serializer, columns)
+
+        rows = queryset.count()
+        timings = {}
+        for path, function in [('ModelSerializer', models), ('values()', values)]:
+            best = min(timeit.repeat(function, number=1, repeat=repeat))
+            timings[path] = best
+            self.stdout.write(f'{name} with {path}: {best:.3f}s, {rows / best:,.0f} rows/s')
+
+        speedup = timings['ModelSerializer'] / timings['values()']
+        self.stdout.write(self.style.SUCCESS(f'{name} from values() is {speedup:.1f}x faster.'))
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.create(options)
+                self.compare(
+                    'Events', Event.objects.select_related('agent', 'user').order_by('-datetime', '-id'),
+                    EventModelSerializer(), EventAPIViewSet.values_columns, options['repeat']
+                )
+                self.compare(
+                    'Agents', Agent.objects.all(), AgentModelSerializer(),
+                    AgentAPIViewSet.values_columns, options['repeat']
+                )
+                raise Rollback()
+        except Rollback:
+            pass
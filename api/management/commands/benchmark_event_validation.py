@@ -0,0 +1,57 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from api.serializers import EventModelSerializer
+from api.validation import event_validator
+from logs.models import Agent, LEVELS
+
+
+class Command(BaseCommand):
+    help = 'Compare the time EventModelSerializer and EventValidator take per event.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument(
+            '--invalid', type=float, default=0.1,
+            help='Fraction of invalid payloads'
+        )
+
+    def payloads(self, count, invalid):
+        agent_id = Agent.objects.values_list('id', flat=True).first()
+        invalid_every = round(1 / invalid) if invalid else 0
+        for i in range(count):
+            payload = {
+                'level': LEVELS[i % len(LEVELS)],
+                'description': f'Benchmark event {i}',
+                'details': 'Traceback (most recent call last): ...',
+                'datetime': '2020-07-01T10:00:00Z',
+                'archived': False,
+                'agent': agent_id,
+            }
+            if invalid_every and i % invalid_every == 0:
+                payload['level'] = 'NOTICE'
+            yield payload
+
+    def handle(self, *args, **options):
+        payloads = list(self.payloads(options['events'], options['invalid']))
+
+        def serializer():
+            for payload in payloads:
+                EventModelSerializer(data=payload).is_valid()
+
+        def validator():
+            for payload in payloads:
+                event_validator.validate(payload)
+
+        timings = {}
+        for name, function in [('EventModelSerializer', serializer), ('EventValidator', validator)]:
+            best = min(timeit.repeat(function, number=1, repeat=options['repeat']))
+            timings[name] = best
+            self.stdout.write(
+                f'{name}: {best:.3f}s, {best / len(payloads) * 1e6:.1f}us per event'
+            )
+
+        speedup = timings['EventModelSerializer'] / timings['EventValidator']
+        self.stdout.write(self.style.SUCCESS(f'EventValidator is {speedup:.1f}x faster.'))
@@ -0,0 +1,104 @@
+import zlib
+
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError
+
+from logs.ingestion import ingestion_setting
+
+CHUNK_SIZE = 64 * 1024
+
+WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'x-gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+class PayloadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Decompressed request body is too large.'
+    default_code = 'payload_too_large'
+
+
+class DecompressedStream:
+    """Read-only file-like object inflating `stream` as it is read.
+
+    Output is produced at most CHUNK_SIZE bytes at a time and reading more
+    than `limit` decompressed bytes raises PayloadTooLarge, so a small
+    compressed body can not expand into a huge one in memory.
+    """
+
+    def __init__(self, stream, wbits, limit):
+        self.stream = stream
+        self.decompressor = zlib.decompressobj(wbits)
+        self.limit = limit
+        self.size = 0
+        self.buffer = b''
+        self.eof = False
+
+    def inflate(self):
+        data = self.decompressor.unconsumed_tail
+        if not data and not self.decompressor.eof:
+            data = self.stream.read(CHUNK_SIZE)
+
+        try:
+            if data:
+                output = self.decompressor.decompress(data, CHUNK_SIZE)
+            else:
+                output = self.decompressor.flush()
+                self.eof = True
+        except zlib.error as exc:
+            raise ParseError(f'Invalid compressed request body - {exc}')
+
+        self.size += len(output)
+        if self.size > self.limit:
+            raise PayloadTooLarge()
+        self.buffer += output
+
+    def take(self, size):
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def read(self, size=-1):
+        while not self.eof and (size is None or size < 0 or len(self.buffer) < size):
+            self.inflate()
+
+        if size is None or size < 0:
+            size = len(self.buffer)
+        return self.take(size)
+
+    def readline(self, size=-1):
+        while not self.eof and b'\n' not in self.buffer:
+            if size is not None and 0 <= size <= len(self.buffer):
+                break
+            self.inflate()
+
+        end = self.buffer.find(b'\n') + 1 or len(self.buffer)
+        if size is not None and size >= 0:
+            end = min(end, size)
+        return self.take(end)
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+
+class DecompressRequestMiddleware:
+    """Inflate request bodies sent with Content-Encoding gzip or deflate.
+
+    The body is decompressed while the parsers read it, up to
+    EVENTS_INGESTION['MAX_DECOMPRESSED_SIZE'] bytes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding in WBITS:
+            request._stream = DecompressedStream(
+                request._stream, WBITS[encoding],
+                ingestion_setting('MAX_DECOMPRESSED_SIZE')
+            )
+            del request.META['HTTP_CONTENT_ENCODING']
+
+        return self.get_response(request)
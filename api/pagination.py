@@ -0,0 +1,150 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db import connections
+from django.db.models import Q
+
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(LimitOffsetPagination):
+    """Limit/offset pagination, or keyset pagination when `cursor` is given.
+
+    Keyset pages continue after the ordering values of the last row seen,
+    followed by the primary key to break ties, instead of skipping `offset`
+    rows, so every page costs the same. An empty `cursor` asks for the first
+    page. NULL values are placed where the database sorts them, so the
+    ordering indexes keep being used.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    default_cursor_limit = 100
+    max_cursor_limit = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            if self.get_limit(request) is None:
+                return None  # Unpaginated, so skip the count query
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.limit = min(
+            self.get_limit(request) or self.default_cursor_limit,
+            self.max_cursor_limit
+        )
+        self.model = queryset.model
+        self.keys = self.get_keys(queryset)
+        self.nulls_largest = connections[queryset.db].features.nulls_order_largest
+
+        direction, position = self.decode_cursor(request)
+        keys = self.keys if direction == 'next' else [reverse(key) for key in self.keys]
+
+        queryset = queryset.order_by(*keys)
+        if position is not None:
+            queryset = queryset.filter(self.after(keys, position))
+        rows = list(queryset[:self.limit + 1])
+
+        has_more = len(rows) > self.limit
+        rows = rows[:self.limit]
+        if direction == 'next':
+            self.has_next, self.has_previous = has_more, position is not None
+        else:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+
+        self.first = self.position(rows[0]) if rows else None
+        self.last = self.position(rows[-1]) if rows else None
+        return rows
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+
+        return Response(OrderedDict([
+            ('next', self.get_cursor_link('next', self.last) if self.has_next else None),
+            ('previous', self.get_cursor_link('previous', self.first) if self.has_previous else None),
+            ('results', data)
+        ]))
+
+    def get_keys(self, queryset):
+        """Ordering of queryset as field names, ending with the primary key"""
+        ordering = list(queryset.query.order_by) or list(self.model._meta.ordering)
+        keys = []
+        for key in ordering:
+            name = key.lstrip('-') if isinstance(key, str) else None
+            if name == 'pk':
+                key, name = key.replace('pk', self.model._meta.pk.name), self.model._meta.pk.name
+            try:
+                self.model._meta.get_field(name)
+            except (FieldDoesNotExist, TypeError):
+                raise ParseError('Cursor pagination only supports ordering by fields.')
+            keys.append(key)
+
+        pk = self.model._meta.pk.name
+        if not {pk, f'-{pk}'} & set(keys):
+            descending = bool(keys) and keys[0].startswith('-')
+            keys.append(f'-{pk}' if descending else pk)
+        return keys
+
+    def after(self, keys, position):
+        """Filter the rows following position in the order of keys"""
+        key, *rest = keys
+        value, *position = position
+        name = key.lstrip('-')
+        descending = key.startswith('-')
+        nulls_last = descending != self.nulls_largest
+
+        if not rest:
+            return Q(**{f'{name}__{"lt" if descending else "gt"}': value})
+
+        if value is None:
+            following = Q(**{f'{name}__isnull': True}) & self.after(rest, position)
+            return following if nulls_last else following | Q(**{f'{name}__isnull': False})
+
+        following = Q(**{f'{name}__{"lt" if descending else "gt"}': value})
+        if nulls_last and self.model._meta.get_field(name).null:
+            following |= Q(**{f'{name}__isnull': True})
+        return following | (Q(**{name: value}) & self.after(rest, position))
+
+    def position(self, row):
+        """Values of the keys in row, a model instance or a values() dict"""
+        attnames = [self.model._meta.get_field(key.lstrip('-')).attname for key in self.keys]
+        if isinstance(row, dict):
+            return [row[attname] for attname in attnames]
+        return [getattr(row, attname) for attname in attnames]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return 'next', None
+
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode()))
+            direction, keys, values = cursor['d'], cursor['k'], cursor['v']
+            if direction not in ('next', 'previous') or keys != self.keys:
+                raise ValueError('Cursor of another ordering')
+            fields = [self.model._meta.get_field(key.lstrip('-')) for key in keys]
+            position = [field.to_python(value) for field, value in zip(fields, values)]
+        except (TypeError, ValueError, KeyError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if len(position) != len(keys):
+            raise NotFound(self.invalid_cursor_message)
+        return direction, position
+
+    def get_cursor_link(self, direction, position):
+        # str keeps the microseconds of datetimes, which DjangoJSONEncoder drops
+        cursor = json.dumps({'d': direction, 'k': self.keys, 'v': position}, default=str)
+        url = remove_query_param(self.request.build_absolute_uri(), self.offset_query_param)
+        encoded = urlsafe_b64encode(cursor.encode()).decode()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+
+def reverse(key):
+    return key[1:] if key.startswith('-') else f'-{key}'
@@ -0,0 +1,59 @@
+import json
+
+try:
+    import msgpack
+except ImportError:  # Optional, MessagePack is only negotiated when installed
+    msgpack = None
+
+from django.conf import settings
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONStream:
+    """Lazily decode a newline delimited JSON body, one line at a time.
+
+    Iterating yields (line index, value) pairs. Lines that are not valid JSON
+    yield a ParseError instead of the value, so the caller can report them
+    without discarding the rest of the body. Blank lines are skipped.
+    """
+
+    def __init__(self, stream, encoding):
+        self.stream = stream
+        self.encoding = encoding
+
+    def __iter__(self):
+        for index, line in enumerate(self.stream):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                yield index, json.loads(line.decode(self.encoding))
+            except ValueError as exc:
+                yield index, ParseError(f'JSON parse error - {exc}')
+
+
+class NDJSONParser(BaseParser):
+    """Parse application/x-ndjson bodies into a NDJSONStream"""
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        return NDJSONStream(stream, encoding)
+
+
+class MessagePackParser(BaseParser):
+    """Parse application/msgpack bodies.
+
+    Timestamp extension values are decoded as timezone aware datetimes.
+    """
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False, timestamp=3)
+        except (TypeError, ValueError) as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
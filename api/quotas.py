@@ -0,0 +1,123 @@
+import time
+from itertools import groupby
+
+from django.db import transaction
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Greatest, Least
+
+from logs.ingestion import ingestion_setting, shared_cache
+from logs.models import Agent, QuotaBucket
+
+
+class TokenBucket:
+    """Token bucket whose state is a QuotaBucket row shared by the workers.
+
+    The bucket holds up to `burst` tokens and gains `rate` tokens per second.
+    The row is refilled by an UPDATE, which locks it until the tokens are
+    taken, so concurrent requests never take more than the bucket holds.
+    """
+
+    def __init__(self, key, rate, burst):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self.wait = 0
+
+    def take(self, count, now=None):
+        """Take up to count tokens, returning how many were taken"""
+        now = Value(float(now or time.time()), output_field=FloatField())
+        buckets = QuotaBucket.objects.filter(key=self.key)
+
+        with transaction.atomic():
+            QuotaBucket.objects.bulk_create(
+                [QuotaBucket(key=self.key, tokens=self.burst, updated_at=now.value)],
+                ignore_conflicts=True
+            )
+            elapsed = Greatest(now - F('updated_at'), Value(0.0, output_field=FloatField()))
+            buckets.update(
+                tokens=Least(Value(float(self.burst), output_field=FloatField()), F('tokens') + elapsed * self.rate),
+                updated_at=Greatest(F('updated_at'), now)
+            )
+            tokens = buckets.values_list('tokens', flat=True).get()
+            taken = min(count, int(tokens))
+            if taken:
+                buckets.update(tokens=F('tokens') - taken)
+        tokens -= taken
+
+        self.wait = 0 if taken == count else (1 - tokens) / self.rate
+        return taken
+
+
+def agent_buckets(agent):
+    buckets = []
+
+    quota = ingestion_setting('AGENT_QUOTA')
+    if quota:
+        buckets.append(TokenBucket(f'quota:agent:{agent.id}', **quota))
+
+    quota = ingestion_setting('ENVIRONMENT_QUOTAS').get(agent.environment)
+    if quota:
+        buckets.append(
+            TokenBucket(f'quota:environment:{agent.environment}', **quota)
+        )
+
+    return buckets
+
+
+def caller_buckets(caller):
+    """Buckets of events without agent, limited by AGENT_QUOTA per caller"""
+    quota = ingestion_setting('AGENT_QUOTA')
+    return [TokenBucket(f'quota:caller:{caller}', **quota)] if quota else []
+
+
+def count_dropped(agent_id, count):
+    key = f'quota:dropped:{agent_id}'
+    cache = shared_cache()
+    cache.add(key, 0, None)
+    cache.incr(key, count)
+
+
+def dropped_counts():
+    """Return {agent id: events over quota} for agents with dropped events.
+
+    Events without agent are counted under 'none'.
+    """
+    ids = [*Agent.objects.values_list('id', flat=True), 'none']
+    counts = shared_cache().get_many([f'quota:dropped:{pk}' for pk in ids])
+    return {
+        key.rsplit(':', 1)[1] if key.endswith(':none') else int(key.rsplit(':', 1)[1]): count
+        for key, count in counts.items()
+    }
+
+
+def apply_quotas(items, caller='anonymous'):
+    """Split (index, event) items in those within and over quota.
+
+    Returns both lists and how many seconds to wait for the next token.
+    Events without agent share the AGENT_QUOTA bucket of caller, the
+    authenticated user or agent sending them.
+    """
+    if not ingestion_setting('AGENT_QUOTA') and not ingestion_setting('ENVIRONMENT_QUOTAS'):
+        return list(items), [], 0
+
+    allowed, over, wait = [], [], 0
+
+    def agent_id(item):
+        return item[1].agent_id or 0
+
+    for pk, group in groupby(sorted(items, key=agent_id), key=agent_id):
+        group = list(group)
+        buckets = agent_buckets(group[0][1].agent) if pk else caller_buckets(caller)
+
+        granted = len(group)
+        for bucket in buckets:
+            granted = bucket.take(granted)
+            wait = max(wait, bucket.wait)
+
+        allowed += group[:granted]
+        over += group[granted:]
+        if granted < len(group):
+            count_dropped(pk or 'none', len(group) - granted)
+
+    allowed.sort(key=lambda item: item[0])
+    return allowed, over, wait
@@ -0,0 +1,74 @@
+import random
+
+from logs.ingestion import ingestion_setting, shared_cache
+
+
+def matching_rule(event, rules):
+    """Return the index of the first rule matching event, or None"""
+    for index, rule in enumerate(rules):
+        if 'level' in rule and rule['level'] != event.level:
+            continue
+        if 'agent' in rule and rule['agent'] != event.agent_id:
+            continue
+        if 'environment' in rule and (
+            event.agent is None or rule['environment'] != event.agent.environment
+        ):
+            continue
+        return index
+    return None
+
+
+def count(rule, kept, dropped):
+    cache = shared_cache()
+    for name, value in (('kept', kept), ('dropped', dropped)):
+        if value:
+            key = f'sampling:{rule}:{name}'
+            cache.add(key, 0, None)
+            cache.incr(key, value)
+
+
+def apply_sampling(items):
+    """Keep the (index, event) items chosen by the sampling rules.
+
+    Counts kept and dropped events per rule and returns the kept items and
+    how many were dropped.
+    """
+    rules = ingestion_setting('SAMPLING_RULES')
+    if not rules:
+        return list(items), 0
+
+    kept, counters = [], {}
+    for item in items:
+        rule = matching_rule(item[1], rules)
+        if rule is None:
+            kept.append(item)
+            continue
+
+        counter = counters.setdefault(rule, [0, 0])
+        if random.random() < rules[rule]['rate']:
+            kept.append(item)
+            counter[0] += 1
+        else:
+            counter[1] += 1
+
+    for rule, (kept_count, dropped_count) in counters.items():
+        count(rule, kept_count, dropped_count)
+
+    return kept, sum(dropped for _, dropped in counters.values())
+
+
+def sampling_counters():
+    """Return the rules with how many matching events were kept and dropped"""
+    rules = ingestion_setting('SAMPLING_RULES')
+    keys = [
+        f'sampling:{rule}:{name}'
+        for rule in range(len(rules)) for name in ('kept', 'dropped')
+    ]
+    counts = shared_cache().get_many(keys)
+
+    counters = []
+    for index, rule in enumerate(rules):
+        kept = counts.get(f'sampling:{index}:kept', 0)
+        dropped = counts.get(f'sampling:{index}:dropped', 0)
+        counters.append({**rule, 'kept': kept, 'dropped': dropped})
+    return counters
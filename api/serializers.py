@@ -1,9 +1,53 @@
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
 from rest_framework import serializers
 
-from logs.models import Permission, Group, User, Event, Agent
+from logs.cache import TTLCache
+from logs.models import Permission, Group, User, Event, EventGroup, Agent
+
+# (model label, pk) -> instance referenced by events. Instances deleted by
+# other processes are dropped when inserting their events fails.
+related_cache = TTLCache(maxsize=10000, ttl=60)
+
+
+@receiver([post_save, post_delete], sender=Agent)
+@receiver([post_save, post_delete], sender=User)
+def invalidate_related(sender, instance, **kwargs):
+    related_cache.pop((sender._meta.label, instance.pk))
+
+
+def cache_key(model, data):
+    """Return the cache key of a primary key value or None if it is invalid"""
+    try:
+        return model._meta.label, model._meta.pk.to_python(data)
+    except (TypeError, ValueError, DjangoValidationError):
+        return None
+
+
+def prefetch_related(model, values):
+    """Cache the instances of the primary keys in values with one IN query"""
+    keys = {cache_key(model, value) for value in values if value is not None}
+    missing = {key[1] for key in keys if key and related_cache.get(key) is None}
+    if missing:
+        for instance in model.objects.filter(pk__in=missing):
+            related_cache.set((model._meta.label, instance.pk), instance)
+
+
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField looking up instances in related_cache first"""
+
+    def to_internal_value(self, data):
+        key = None if self.pk_field else cache_key(self.get_queryset().model, data)
+        instance = related_cache.get(key) if key else None
+        if instance is None:
+            instance = super().to_internal_value(data)
+            if key:
+                related_cache.set(key, instance)
+        return instance
 
 
 class PermissionModelSerializer(serializers.ModelSerializer):
@@ -90,6 +134,8 @@ class AgentModelSerializer(serializers.ModelSerializer):
 
 
 class EventModelSerializer(serializers.ModelSerializer):
+    serializer_related_field = CachedPrimaryKeyRelatedField
+
     source = serializers.CharField(read_only=True)
     collected_by = serializers.CharField(read_only=True)
 
@@ -97,6 +143,21 @@ class EventModelSerializer(serializers.ModelSerializer):
         model = Event
         fields = '__all__'
 
+    def __init__(self, *args, fields=None, **kwargs):
+        """Render only `fields`, when given"""
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class EventGroupModelSerializer(serializers.ModelSerializer):
+    source = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = EventGroup
+        fields = '__all__'
+
 
 class RecoverFormSerializer(serializers.Serializer):
     email = serializers.EmailField()
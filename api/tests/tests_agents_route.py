@@ -3,6 +3,7 @@ from api.tests.TestCase import TestCase, PermissionUtilities
 from rest_framework import status
 from rest_framework.test import APIClient
 
+from api.serializers import AgentModelSerializer
 from logs.models import User, Agent
 
 class AgentRouteCase(TestCase, PermissionUtilities):
@@ -67,6 +68,11 @@ class AgentRouteCase(TestCase, PermissionUtilities):
                 self.assertEqual(expected_agent.environment, agent.get('environment'))
                 self.assertEqual(expected_agent.user_id, agent.get('user'))
 
+        Agent.objects.create(environment='production', name='with address', address='10.0.0.1')
+        response = self.client.get(f'{self.route}')
+        with self.subTest('Must render agents as the serializer', response=response):
+            self.assertEqual(AgentModelSerializer(Agent.objects.all(), many=True).data, response.json())
+
     def test_create_agent(self):
         response = self.client.post(f'{self.route}', data={}, format='json')
         with self.subTest('Must return Unauthorized', response=response):
@@ -0,0 +1,100 @@
+from api.tests.TestCase import TestCase, PermissionUtilities
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from django.utils import timezone
+
+from logs.models import Agent, Event, EventGroup
+
+
+class EventGroupRouteCase(TestCase, PermissionUtilities):
+    route = '/api/event-groups/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.create_users_with_permissions(EventGroup)
+
+        self.agent = Agent.objects.create(environment='production', name='api')
+        other = Agent.objects.create(environment='testing', name='worker')
+
+        self.first_seen = timezone.now() - timezone.timedelta(days=1)
+        for i in range(3):
+            Event.objects.create(
+                level='ERROR', agent=self.agent, details=f'details {i}',
+                description=f'Timeout after {i * 10} ms',
+                datetime=self.first_seen + timezone.timedelta(hours=i)
+            )
+        Event.objects.create(
+            level='ERROR', agent=other, description='Timeout after 5 ms', details='other agent'
+        )
+        Event.objects.create(
+            level='WARNING', agent=self.agent, description='Timeout after 5 ms', details='other level'
+        )
+
+    def test_groups_are_updated_on_insert(self):
+        group = EventGroup.objects.get(agent=self.agent, level='ERROR')
+        with self.subTest('Occurrences must share the same group'):
+            self.assertEqual(3, EventGroup.objects.count())
+            self.assertEqual(3, group.count)
+            self.assertEqual(self.first_seen, group.first_seen)
+            self.assertEqual(self.first_seen + timezone.timedelta(hours=2), group.last_seen)
+            self.assertEqual('Timeout after 0 ms', group.description)
+
+        self.login(permission='all')
+        event = {'level': 'ERROR', 'agent': self.agent.id, 'description': 'Timeout after 99 ms', 'details': 'd'}
+        response = self.client.post('/api/events/bulk/', data=[event, event], format='json')
+        with self.subTest('Bulk inserts must be counted', response=response):
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            group.refresh_from_db()
+            self.assertEqual(5, group.count)
+            self.assertEqual(3, EventGroup.objects.count())
+
+        response = self.client.get(f'/api/events/?fingerprint={group.fingerprint}')
+        with self.subTest('Events must be filtered by fingerprint', response=response):
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(5, len(response.json()))
+
+        event = Event.objects.filter(fingerprint=group.fingerprint).first()
+        event.description = 'Connection refused'
+        event.save()
+        with self.subTest('Updated events must stay in the group they were counted in'):
+            event.refresh_from_db()
+            self.assertEqual(group.fingerprint, event.fingerprint)
+            group.refresh_from_db()
+            self.assertEqual(5, group.count)
+            self.assertEqual(3, EventGroup.objects.count())
+
+    def test_list_groups(self):
+        response = self.client.get(self.route)
+        with self.subTest('Must return Unauthorized', response=response):
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+            body = response.json()
+            self.assertIn('detail', body)
+            self.assertIn('authentication', body.get('detail').lower())
+
+        self.login(permission='delete')
+        response = self.client.get(self.route)
+        with self.subTest('Must return Forbidden', response=response):
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+            body = response.json()
+            self.assertIn('detail', body)
+            self.assertIn('permission', body.get('detail').lower())
+
+        self.login(permission='view')
+        response = self.client.get(f'{self.route}?ordering=-count')
+        with self.subTest('Must return groups and a success code', response=response):
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            groups = response.json()
+            self.assertEqual([3, 1, 1], [group.get('count') for group in groups])
+            self.assertEqual('api', groups[0].get('source'))
+
+        response = self.client.get(f'{self.route}?environment=testing')
+        with self.subTest('Groups must be filtered by environment', response=response):
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(['worker'], [group.get('source') for group in response.json()])
+
+        self.login(permission='all')
+        response = self.client.post(self.route, data={}, format='json')
+        with self.subTest('Groups must be read only', response=response):
+            self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -0,0 +1,185 @@
+import asyncio
+import gzip
+import json
+from unittest import mock
+
+from django.test import TransactionTestCase
+
+from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.asgi import EventIngestionApplication, IngestionRouter
+from api.serializers import related_cache
+from logs.ingestion import insert_events
+from logs.models import User, Agent, AgentKey, Event
+
+
+class EventAsyncRouteCase(TransactionTestCase):
+    """Requests run in threads with their own connections, so they must be committed"""
+    route = '/api/events/async/'
+
+    simple_valid_event = {
+        'level': 'DEBUG',
+        'description': 'A simple valid description',
+        'details': 'A simple valid detail'
+    }
+
+    def setUp(self):
+        self.application = EventIngestionApplication(workers=2, batch_size=100, flush_interval=0.05)
+        self.addCleanup(self.application.executor.shutdown)
+
+        self.agent = Agent.objects.create(environment='testing', name='agent')
+        _, key = AgentKey.generate(self.agent)
+        self.authorization = f'Agent {key}'
+
+    async def request(self, body, method='POST', authorization=None, headers=()):
+        messages = []
+        headers = [(b'content-type', b'application/json'), *headers]
+        if authorization:
+            headers.append((b'authorization', authorization.encode()))
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+
+        async def receive():
+            return {'type': 'http.request', 'body': body}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': self.route, 'headers': headers}
+        await self.application(scope, receive, send)
+        return messages[0]['status'], json.loads(messages[1]['body'])
+
+    def post(self, body, **kwargs):
+        return asyncio.run(self.request(body, **kwargs))
+
+    def test_create_events(self):
+        code, body = self.post(self.simple_valid_event)
+        with self.subTest('Must return Unauthorized', body=body):
+            self.assertEqual(code, status.HTTP_401_UNAUTHORIZED)
+            self.assertIn('authentication', body.get('detail').lower())
+
+        user = User.objects.create(username='viewer', email='viewer@email.com')
+        code, body = self.post(self.simple_valid_event, authorization=f'Bearer {AccessToken.for_user(user)}')
+        with self.subTest('Must return Forbidden', body=body):
+            self.assertEqual(code, status.HTTP_403_FORBIDDEN)
+            self.assertIn('permission', body.get('detail').lower())
+
+        code, body = self.post(self.simple_valid_event, authorization=self.authorization)
+        with self.subTest('Must create a single event', body=body):
+            self.assertEqual(code, status.HTTP_201_CREATED)
+            self.assertEqual(1, body.get('created'))
+            self.assertEqual(1, Event.objects.count())
+
+        code, body = self.post([self.simple_valid_event, {}], authorization=self.authorization)
+        with self.subTest('Must report invalid events as the bulk route', body=body):
+            self.assertEqual(code, status.HTTP_207_MULTI_STATUS)
+            self.assertEqual(1, body.get('created'))
+            self.assertEqual([1], [error.get('index') for error in body.get('errors')])
+            self.assertEqual(2, Event.objects.count())
+
+        other = Agent.objects.create(environment='testing', name='other')
+        code, body = self.post(
+            [{**self.simple_valid_event, 'agent': other.id}, self.simple_valid_event],
+            authorization=self.authorization
+        )
+        with self.subTest('Events must belong to the agent of the key', body=body):
+            self.assertEqual(code, status.HTTP_207_MULTI_STATUS)
+            self.assertEqual([0], [error.get('index') for error in body.get('errors')])
+            self.assertEqual(3, Event.objects.filter(agent=self.agent).count())
+
+        code, body = self.post({}, method='GET', authorization=self.authorization)
+        with self.subTest('Must only accept POST', body=body):
+            self.assertEqual(code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_concurrent_requests_are_inserted_together(self):
+        async def concurrent_requests():
+            return await asyncio.gather(*[
+                self.request(self.simple_valid_event, authorization=self.authorization)
+                for i in range(5)
+            ])
+
+        with mock.patch('api.asgi.insert_events', wraps=insert_events) as insert:
+            responses = asyncio.run(concurrent_requests())
+
+        self.assertEqual([201] * 5, [code for code, body in responses])
+        self.assertEqual(5, Event.objects.count())
+        self.assertEqual(1, insert.call_count)
+
+    def test_create_events_of_deleted_agents(self):
+        stale = Agent(id=self.agent.id + 1, environment='testing', name='stale')
+        Agent.objects.create(id=stale.id, environment='testing', name='stale')
+        related_cache.set(('logs.Agent', stale.id), stale)
+        self.addCleanup(related_cache.clear)
+        # Another process deletes the agent: this one keeps it cached
+        Agent.objects.filter(id=stale.id).delete()
+
+        user = User.objects.create_superuser('all', 'all@email.com', 'all')
+        authorization = f'Bearer {AccessToken.for_user(user)}'
+
+        async def concurrent_requests():
+            return await asyncio.gather(
+                self.request([self.simple_valid_event, {**self.simple_valid_event, 'agent': stale.id}],
+                             authorization=authorization),
+                self.request(self.simple_valid_event, authorization=authorization),
+            )
+
+        (code, body), (other_code, other_body) = asyncio.run(concurrent_requests())
+        with self.subTest('Only the events of the deleted agent must fail', body=body):
+            self.assertEqual(code, status.HTTP_207_MULTI_STATUS)
+            self.assertEqual(1, body.get('created'))
+            self.assertEqual([1], [error.get('index') for error in body.get('errors')])
+            self.assertIn('does not exist', body['errors'][0]['errors']['agent'][0])
+            self.assertEqual(other_code, status.HTTP_201_CREATED)
+            self.assertEqual(2, Event.objects.count())
+
+        with mock.patch('api.asgi.insert_events', side_effect=RuntimeError('database is down')), \
+                self.assertLogs('api.asgi', 'ERROR'):
+            code, body = self.post(self.simple_valid_event, authorization=self.authorization)
+        with self.subTest('Unexpected errors must return Internal Server Error', body=body):
+            self.assertEqual(code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+            self.assertIn('error', body.get('detail'))
+
+    def test_create_events_with_headers(self):
+        body = gzip.compress(json.dumps([self.simple_valid_event] * 2).encode())
+        code, body = self.post(body, authorization=self.authorization, headers=[(b'content-encoding', b'gzip')])
+        with self.subTest('Must inflate gzip bodies', body=body):
+            self.assertEqual(code, status.HTTP_201_CREATED)
+            self.assertEqual(2, Event.objects.count())
+
+        with self.settings(EVENTS_INGESTION={'MAX_DECOMPRESSED_SIZE': 100}):
+            body = gzip.compress(json.dumps([self.simple_valid_event] * 100).encode())
+            code, body = self.post(body, authorization=self.authorization, headers=[(b'content-encoding', b'gzip')])
+        with self.subTest('Must limit the inflated size', body=body):
+            self.assertEqual(code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        code, body = self.post(
+            self.simple_valid_event, authorization=self.authorization, headers=[(b'content-encoding', b'br')]
+        )
+        with self.subTest('Must reject other encodings', body=body):
+            self.assertEqual(code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        code, body = self.post(
+            self.simple_valid_event, authorization=self.authorization, headers=[(b'idempotency-key', b'event-1')]
+        )
+        with self.subTest('Must reject Idempotency-Key', body=body):
+            self.assertEqual(code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('Idempotency-Key', body.get('detail'))
+            self.assertEqual(2, Event.objects.count())
+
+    def test_spool_is_replayed_on_startup(self):
+        router = IngestionRouter(None, self.application, self.route)
+        messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        with mock.patch('api.asgi.start_spool_replay') as start_spool_replay:
+            asyncio.run(router(scope={'type': 'lifespan'}, receive=receive, send=send))
+
+        start_spool_replay.assert_called_once_with()
+        self.assertEqual(['lifespan.startup.complete', 'lifespan.shutdown.complete'], sent)
@@ -1,11 +1,32 @@
+import gzip
+import io
+import json
+import math
+import time
+import zlib
+from datetime import timedelta
+from unittest import mock, skipUnless
+
 from api.tests.TestCase import TestCase, PermissionUtilities
 
 from rest_framework import status
 from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
-from logs.models import User, Agent, Event
+from api.idempotency import recent_responses
+from api.parsers import msgpack
+from api.quotas import TokenBucket
+from api.serializers import EventModelSerializer, related_cache
+from api.validation import event_validator
+from logs.models import User, Agent, AgentKey, Event, IdempotencyKey, QuotaBucket
+from logs.buffer import EventBuffer
 
 
 class EventRouteCase(TestCase, PermissionUtilities):
@@ -88,11 +109,16 @@ class EventRouteCase(TestCase, PermissionUtilities):
         with self.subTest('Must return data and a success code', response=response):
             events = response.json()
 
-            all_fields = ['id', 'level', 'description', 'details', 'datetime', 'archived', 'source', 'collected_by']
+            # The details are left out of the list
+            all_fields = ['id', 'level', 'description', 'datetime', 'archived', 'source', 'collected_by']
+            # Without datetime, the newest events come first
+            expected_events = sorted(self.events_list, key=lambda event: -event.id)
+            self.assertEqual(len(expected_events), len(events))
             for i, event in enumerate(events):
-                expected_event = self.events_list[i]
+                expected_event = expected_events[i]
                 for field in all_fields:
                     self.assertEqual(getattr(expected_event, field), event.get(field))
+                self.assertNotIn('details', event)
 
                 self.assertEqual(expected_event.user_id, event.get('user'))
                 self.assertEqual(expected_event.agent_id, event.get('agent'))
@@ -169,6 +195,765 @@ class EventRouteCase(TestCase, PermissionUtilities):
             db_events = Event.objects.count()
             self.assertEqual(expected_events, db_events)
 
+    def test_create_event_with_agent_key(self):
+        agent = Agent.objects.get(name='agent 1')
+        agent_key, key = AgentKey.generate(agent)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Agent invalid')
+        response = self.client.post(f'{self.route}', data=self.simple_valid_event, format='json')
+        with self.subTest('Unknown key must return Unauthorized', response=response):
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertIn('agent key', response.json().get('detail').lower())
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Agent {key}')
+        response = self.client.get(f'{self.route}')
+        with self.subTest('Agent keys must not list events', response=response):
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        response = self.client.post(f'{self.route}', data=self.simple_valid_event, format='json')
+        with self.subTest('Agent keys must create events', response=response):
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(len(self.events_list) + 1, Event.objects.count())
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(f'{self.route}', data=self.simple_valid_event, format='json')
+        with self.subTest('Cached keys must not query authentication tables', response=response):
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            for query in context.captured_queries:
+                self.assertNotIn('logs_agentkey', query['sql'])
+                self.assertNotIn('auth_', query['sql'])
+
+        with self.subTest('Events must belong to the agent of the key'):
+            self.assertEqual(
+                [agent.id, agent.id],
+                list(Event.objects.order_by('-id').values_list('agent', flat=True)[:2])
+            )
+
+        other = Agent.objects.get(name='agent 2')
+        response = self.client.post(
+            f'{self.route}', data={**self.simple_valid_event, 'agent': other.id}, format='json'
+        )
+        with self.subTest('Events of another agent must return Bad Request', response=response):
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('agent', response.json())
+
+        events = [{**self.simple_valid_event, 'agent': str(agent.id)}, {**self.simple_valid_event, 'agent': other.id}]
+        response = self.client.post(f'{self.route}bulk/', data=events, format='json')
+        with self.subTest('Bulk events of another agent must be rejected', response=response):
+            self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+            self.assertEqual([1], [error['index'] for error in response.json()['errors']])
+            self.assertFalse(Event.objects.filter(agent=other).exclude(id__in=[e.id for e in self.events_list]).exists())
+
+        agent_key.is_active = False
+        agent_key.save()
+        response = self.client.post(f'{self.route}', data=self.simple_valid_event, format='json')
+        with self.subTest('Revoked keys must return Unauthorized', response=response):
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_create_event_buffered(self):
+        buffer = EventBuffer(maxsize=1, batch_size=10, flush_interval=2)
+        self.login(permission='add')
+
+        with mock.patch('api.views.event_buffer', buffer), \
+                self.settings(EVENTS_INGESTION={'MODE': 'buffered'}):
+            invalid = self.client.post(f'{self.route}', data={}, format='json')
+            accepted = self.client.post(f'{self.route}', data=self.full_valid_event, format='json')
+            saturated = self.client.post(f'{self.route}', data=self.simple_valid_event, format='json')
+
+        with self.subTest('Fields must be validated before queueing', response=invalid):
+            self.assertEqual(invalid.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertSubstringIn('required', invalid.json().get('level'))
+
+        with self.subTest('Event must be accepted and not inserted yet', response=accepted):
+            self.assertEqual(accepted.status_code, status.HTTP_202_ACCEPTED)
+            self.assertEqual(1, buffer.stats().get('depth'))
+            self.assertEqual(len(self.events_list), Event.objects.count())
+
+        with self.subTest('Full buffer must ask to retry later', response=saturated):
+            self.assertEqual(saturated.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual('2', saturated['Retry-After'])
+
+        with self.subTest('Flush must insert queued events'):
+            self.assertEqual(1, buffer.flush())
+            self.assertEqual(len(self.events_list) + 1, Event.objects.count())
+            stats = buffer.stats()
+            self.assertEqual(0, stats.get('depth'))
+            self.assertEqual(1, stats.get('flushed'))
+            self.assertEqual(1, stats.get('flushes'))
+
+    def test_bulk_create_events(self):
+        route = f'{self.route}bulk/'
+        response = self.client.post(route, data=[], format='json')
+        with self.subTest('Must return Unauthorized', response=response):
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.login(permission='view')
+        response = self.client.post(route, data=[], format='json')
+        with self.subTest('Must return Forbidden', response=response):
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.login(permission='add')
+        response = self.client.post(route, data=self.simple_valid_event, format='json')
+        with self.subTest('Body must be a list', response=response):
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('detail', response.json())
+
+        data = [self.invalid_event, {}]
+        response = self.client.post(route, data=data, format='json')
+        with self.subTest('Must return errors when no event is valid', response=response):
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            body = response.json()
+            self.assertEqual(0, body.get('created'))
+            self.assertEqual([0, 1], [error.get('index') for error in body.get('errors')])
+            self.assertSubstringIn('valid', body.get('errors')[0]['errors'].get('level'))
+            self.assertSubstringIn('required', body.get('errors')[1]['errors'].get('level'))
+            self.assertEqual(len(self.events_list), Event.objects.count())
+
+        data = [self.simple_valid_event, self.invalid_event, self.full_valid_event]
+        response = self.client.post(route, data=data, format='json')
+        with self.subTest('Valid events must be created and errors reported', response=response):
+            self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+            body = response.json()
+            self.assertEqual(2, body.get('created'))
+            self.assertEqual([1], [error.get('index') for error in body.get('errors')])
+            self.assertEqual(len(self.events_list) + 2, Event.objects.count())
+
+        data = [self.simple_valid_event] * 3
+        response = self.client.post(route, data=data, format='json')
+        with self.subTest('All events must be created', response=response):
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual({'created': 3, 'rejected': 0, 'sampled': 0, 'errors': []}, response.json())
+            self.assertEqual(len(self.events_list) + 5, Event.objects.count())
+
+        with self.settings(EVENTS_INGESTION={'BULK_MAX_SIZE': 2}):
+            response = self.client.post(route, data=data, format='json')
+        with self.subTest('Bulk size must be limited', response=response):
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('2', response.json().get('detail'))
+
+    def test_bulk_create_events_from_ndjson(self):
+        route = f'{self.route}bulk/'
+        lines = [
+            json.dumps(self.simple_valid_event),
+            '{"level": "INFO", ',
+            '',
+            json.dumps(self.invalid_event),
+            json.dumps({**self.full_valid_event, 'datetime': None}),
+            json.dumps(self.simple_valid_event)
+        ]
+        body = '\n'.join(lines)
+
+        self.login(permission='add')
+        with self.settings(EVENTS_INGESTION={'STREAM_CHUNK_SIZE': 2, 'STREAM_MAX_ERRORS': 1}):
+            response = self.client.post(route, data=body, content_type='application/x-ndjson')
+        with self.subTest('Valid lines must be created in chunks', response=response):
+            self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+            body = response.json()
+            self.assertEqual(3, body.get('created'))
+            self.assertEqual(2, body.get('rejected'))
+            self.assertEqual(1, len(body.get('errors')))
+            self.assertEqual(1, body.get('errors')[0].get('index'))
+            self.assertIn('JSON parse error', body.get('errors')[0]['errors'].get('detail'))
+            self.assertEqual(len(self.events_list) + 3, Event.objects.count())
+
+    def test_create_events_over_quota(self):
+        cache.clear()
+        self.login(permission='all')
+        agent = self.full_valid_event['agent']
+        quota = {'AGENT_QUOTA': {'rate': 0.01, 'burst': 2}}
+
+        with self.settings(EVENTS_INGESTION=quota):
+            responses = [
+                self.client.post(f'{self.route}', data=self.full_valid_event, format='json')
+                for i in range(3)
+            ]
+        with self.subTest('Events over quota must be rejected', response=responses[-1]):
+            self.assertEqual([201, 201, 429], [response.status_code for response in responses])
+            self.assertEqual('100', responses[-1]['Retry-After'])
+            self.assertEqual(len(self.events_list) + 2, Event.objects.count())
+
+        cache.clear()
+        with self.settings(EVENTS_INGESTION=quota):
+            response = self.client.post(f'{self.route}', data=self.full_valid_event, format='json')
+        with self.subTest('Quotas must be kept in the database, for all workers', response=response):
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            bucket = QuotaBucket.objects.get(key=f'quota:agent:{agent}')
+            self.assertLess(bucket.tokens, 1)
+
+        now = time.time()
+        buckets = [TokenBucket('quota:test', rate=1, burst=3) for i in range(2)]
+        with self.subTest('Workers must share the tokens of a bucket'):
+            self.assertEqual(2, buckets[0].take(2, now))
+            self.assertEqual(1, buckets[1].take(2, now))
+            self.assertEqual(0, buckets[0].take(1, now))
+            self.assertEqual(1.0, buckets[0].wait)
+            self.assertEqual(2, buckets[1].take(5, now + 2))
+            self.assertEqual(3, buckets[1].take(5, now + 60))
+
+        with self.settings(EVENTS_INGESTION={**quota, 'QUOTA_ACTION': 'drop'}):
+            response = self.client.post(f'{self.route}', data=self.full_valid_event, format='json')
+        with self.subTest('Events over quota may be dropped', response=response):
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            self.assertIn('dropped', response.json().get('detail'))
+            self.assertEqual(len(self.events_list) + 2, Event.objects.count())
+
+        cache.clear()
+        data = [self.full_valid_event, self.simple_valid_event] * 2
+        environment_quota = {'ENVIRONMENT_QUOTAS': {'testing': {'rate': 0.01, 'burst': 1}}}
+        with self.settings(EVENTS_INGESTION=environment_quota):
+            response = self.client.post(f'{self.route}bulk/', data=data, format='json')
+        with self.subTest('Bulk events over quota must be reported', response=response):
+            self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+            body = response.json()
+            self.assertEqual(3, body.get('created'))
+            self.assertEqual([2], [error.get('index') for error in body.get('errors')])
+            self.assertIn('quota', body.get('errors')[0]['errors'].get('detail'))
+
+        response = self.client.get('/api/ingestion/')
+        with self.subTest('Dropped events must be counted per agent', response=response):
+            self.assertEqual({str(agent): 1}, response.json()['quotas']['dropped'])
+
+        cache.clear()
+        with self.settings(EVENTS_INGESTION={'AGENT_QUOTA': {'rate': 0.01, 'burst': 1}}):
+            responses = [
+                self.client.post(f'{self.route}', data=self.simple_valid_event, format='json')
+                for i in range(3)
+            ]
+        with self.subTest('Events without agent must be limited per caller'):
+            self.assertEqual([201, 429, 429], [response.status_code for response in responses])
+
+        response = self.client.get('/api/ingestion/')
+        with self.subTest('Dropped events without agent must be counted', response=response):
+            self.assertEqual({'none': 2}, response.json()['quotas']['dropped'])
+
+    def test_create_events_sampled(self):
+        cache.clear()
+        self.login(permission='all')
+        rules = {'SAMPLING_RULES': [
+            {'level': 'DEBUG', 'environment': 'testing', 'rate': 0},
+            {'level': 'DEBUG', 'rate': 1},
+        ]}
+        debug_event = {**self.full_valid_event, 'level': 'DEBUG'}
+
+        with self.settings(EVENTS_INGESTION=rules):
+            response = self.client.post(f'{self.route}', data=debug_event, format='json')
+        with self.subTest('Sampled out events must not be inserted', response=response):
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            self.assertIn('sampling', response.json().get('detail'))
+            self.assertEqual(len(self.events_list), Event.objects.count())
+
+        data = [debug_event, self.simple_valid_event, self.full_valid_event]
+        with self.settings(EVENTS_INGESTION=rules):
+            response = self.client.post(f'{self.route}bulk/', data=data, format='json')
+            counters = self.client.get('/api/ingestion/').json().get('sampling')
+        with self.subTest('Rules must apply to bulk events', response=response):
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(2, response.json().get('created'))
+            self.assertEqual(1, response.json().get('sampled'))
+
+        with self.subTest('Kept and dropped events must be counted per rule'):
+            self.assertEqual([0, 1], [rule.get('kept') for rule in counters])
+            self.assertEqual([2, 0], [rule.get('dropped') for rule in counters])
+            self.assertEqual('testing', counters[0].get('environment'))
+
+    def test_create_events_from_compressed_body(self):
+        self.login(permission='add')
+
+        body = gzip.compress(json.dumps(self.simple_valid_event).encode())
+        response = self.client.post(
+            f'{self.route}', data=body, content_type='application/json',
+            HTTP_CONTENT_ENCODING='gzip'
+        )
+        with self.subTest('Gzip body must be decompressed', response=response):
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(self.simple_valid_event.get('description'), response.json().get('description'))
+
+        lines = '\n'.join([json.dumps(self.simple_valid_event)] * 3)
+        response = self.client.post(
+            f'{self.route}bulk/', data=zlib.compress(lines.encode()),
+            content_type='application/x-ndjson', HTTP_CONTENT_ENCODING='deflate'
+        )
+        with self.subTest('Deflate body must be decompressed', response=response):
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(3, response.json().get('created'))
+            self.assertEqual(len(self.events_list) + 4, Event.objects.count())
+
+        response = self.client.post(
+            f'{self.route}', data=b'not compressed', content_type='application/json',
+            HTTP_CONTENT_ENCODING='gzip'
+        )
+        with self.subTest('Invalid compressed body must be rejected', response=response):
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('compressed', response.json().get('detail'))
+
+        event = {**self.simple_valid_event, 'details': ' ' * 4096}
+        with self.settings(EVENTS_INGESTION={'MAX_DECOMPRESSED_SIZE': 1024}):
+            response = self.client.post(
+                f'{self.route}', data=gzip.compress(json.dumps(event).encode()),
+                content_type='application/json', HTTP_CONTENT_ENCODING='gzip'
+            )
+        with self.subTest('Decompressed size must be limited', response=response):
+            self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            self.assertEqual(len(self.events_list) + 4, Event.objects.count())
+
+    def test_create_events_resolves_related_from_cache(self):
+        related_cache.clear()
+        self.login(permission='all')
+
+        def related_queries(context):
+            return [
+                query['sql'] for query in context.captured_queries
+                if 'FROM "logs_agent"' in query['sql'] or 'FROM "auth_user"' in query['sql']
+            ]
+
+        # One auth_user query is made by the token authentication
+        for expected in [3, 1]:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(f'{self.route}', data=self.full_valid_event, format='json')
+            with self.subTest('Agent and user must be cached', response=response, expected=expected):
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+                self.assertEqual(expected, len(related_queries(context)))
+
+        agent = Agent.objects.get(pk=self.full_valid_event['agent'])
+        agent.name = 'renamed'
+        agent.save()
+        response = self.client.post(f'{self.route}', data=self.full_valid_event, format='json')
+        with self.subTest('Saving an agent must invalidate it', response=response):
+            self.assertEqual('renamed', response.json().get('source'))
+
+        related_cache.clear()
+        agents = Agent.objects.all()
+        data = [{**self.simple_valid_event, 'agent': agent.id} for agent in agents]
+        data.append({**self.simple_valid_event, 'agent': 999})
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(f'{self.route}bulk/', data=data, format='json')
+        with self.subTest('Bulk events must resolve agents with one query', response=response):
+            self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+            self.assertEqual(len(agents), response.json().get('created'))
+            self.assertIn('does not exist', str(response.json().get('errors')))
+            queries = [sql for sql in related_queries(context) if 'logs_agent' in sql]
+            self.assertIn(' IN (', queries[0])
+            self.assertEqual(2, len(queries))  # The IN query and the missing pk
+
+    def test_bulk_validation_matches_serializer(self):
+        agent, user = self.full_valid_event['agent'], self.full_valid_event['user']
+        payloads = [
+            self.simple_valid_event, self.full_valid_event, self.invalid_event,
+            {**self.full_valid_event, 'datetime': '2020-07-01T10:00:00', 'archived': 'true'},
+            {**self.simple_valid_event, 'description': '  padded  ', 'agent': str(agent), 'user': user},
+            {**self.simple_valid_event, 'description': '   ', 'details': 'nul\x00'},
+            {**self.simple_valid_event, 'description': 42, 'details': None, 'level': None},
+            {**self.simple_valid_event, 'level': 'debug', 'datetime': 'yesterday', 'archived': 2},
+            {**self.simple_valid_event, 'agent': 999, 'user': 'one', 'datetime': None},
+            {**self.simple_valid_event, 'agent': True, 'id': 1, 'fingerprint': 'x'},
+            {}, [], None, 'event',
+        ]
+
+        for payload in payloads:
+            serializer = EventModelSerializer(data=payload)
+            valid = serializer.is_valid()
+            validated_data, errors = event_validator.validate(payload)
+            with self.subTest(payload=payload):
+                self.assertEqual(serializer.validated_data if valid else None, validated_data)
+                self.assertEqual(None if valid else serializer.errors, errors)
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_create_events_with_msgpack(self):
+        self.login(permission='all')
+        event = {**self.simple_valid_event, 'datetime': timezone.now()}
+
+        response = self.client.post(
+            f'{self.route}', data=msgpack.packb(event, datetime=True),
+            content_type='application/msgpack', HTTP_ACCEPT='application/msgpack'
+        )
+        with self.subTest('MessagePack bodies must be parsed and rendered', response=response):
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual('application/msgpack', response['Content-Type'])
+            body = msgpack.unpackb(response.content)
+            self.assertEqual(event.get('description'), body.get('description'))
+            self.assertEqual(event['datetime'], Event.objects.get(pk=body['id']).datetime)
+
+        response = self.client.post(
+            f'{self.route}bulk/', data=msgpack.packb([self.simple_valid_event] * 2),
+            content_type='application/msgpack', HTTP_ACCEPT='application/msgpack'
+        )
+        with self.subTest('Bulk events may be sent as MessagePack', response=response):
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(2, msgpack.unpackb(response.content).get('created'))
+
+        response = self.client.get(f'{self.route}?format=msgpack')
+        with self.subTest('Listings may be rendered as MessagePack', response=response):
+            self.assertEqual(len(self.events_list) + 3, len(msgpack.unpackb(response.content)))
+
+        response = self.client.post(
+            f'{self.route}', data=b'\xc1', content_type='application/msgpack'
+        )
+        with self.subTest('Invalid MessagePack bodies must be rejected', response=response):
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('MessagePack', response.json().get('detail'))
+
+    def test_create_events_with_idempotency_key(self):
+        recent_responses.clear()
+        self.login(permission='add')
+
+        responses = [
+            self.client.post(
+                f'{self.route}', data=self.simple_valid_event, format='json',
+                HTTP_IDEMPOTENCY_KEY='event-1'
+            )
+            for i in range(2)
+        ]
+        with self.subTest('Retries must return the first response', response=responses[-1]):
+            self.assertEqual([201, 201], [response.status_code for response in responses])
+            self.assertEqual(responses[0].json(), responses[1].json())
+            self.assertEqual('true', responses[1]['Idempotent-Replayed'])
+            self.assertEqual(len(self.events_list) + 1, Event.objects.count())
+
+        recent_responses.clear()
+        response = self.client.post(
+            f'{self.route}', data=self.simple_valid_event, format='json',
+            HTTP_IDEMPOTENCY_KEY='event-1'
+        )
+        with self.subTest('Stored keys must survive the process cache', response=response):
+            self.assertEqual(responses[0].json(), response.json())
+            self.assertEqual(len(self.events_list) + 1, Event.objects.count())
+
+        data = [self.simple_valid_event, self.invalid_event]
+        responses = [
+            self.client.post(
+                f'{self.route}bulk/', data=data, format='json',
+                HTTP_IDEMPOTENCY_KEY='bulk-1'
+            )
+            for i in range(2)
+        ]
+        with self.subTest('Bulk retries must return the first response', response=responses[-1]):
+            self.assertEqual([207, 207], [response.status_code for response in responses])
+            self.assertEqual(responses[0].json(), responses[1].json())
+            self.assertEqual(len(self.events_list) + 2, Event.objects.count())
+
+        self.login(permission='all')
+        response = self.client.post(
+            f'{self.route}', data=self.simple_valid_event, format='json',
+            HTTP_IDEMPOTENCY_KEY='event-1'
+        )
+        with self.subTest('Keys must be scoped by user', response=response):
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertNotIn('Idempotent-Replayed', response)
+            self.assertEqual(len(self.events_list) + 3, Event.objects.count())
+
+        user = User.objects.get(username='all')
+        IdempotencyKey.objects.create(
+            owner=f'user:{user.pk}', key='pending',
+            expires_at=timezone.now() + timedelta(minutes=1)
+        )
+        response = self.client.post(
+            f'{self.route}', data=self.simple_valid_event, format='json',
+            HTTP_IDEMPOTENCY_KEY='pending'
+        )
+        with self.subTest('Keys in progress must be a conflict', response=response):
+            self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+            self.assertEqual(len(self.events_list) + 3, Event.objects.count())
+
+        IdempotencyKey.objects.filter(key='pending').update(locked_until=timezone.now())
+        response = self.client.post(
+            f'{self.route}', data=self.simple_valid_event, format='json',
+            HTTP_IDEMPOTENCY_KEY='pending'
+        )
+        with self.subTest('Keys whose lock expired must be taken over', response=response):
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(len(self.events_list) + 4, Event.objects.count())
+            record = IdempotencyKey.objects.get(key='pending')
+            self.assertEqual(201, record.status_code)
+            self.assertGreater(record.locked_until, timezone.now())
+
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        call_command('purge_idempotency_keys', stdout=io.StringIO())
+        with self.subTest('Expired keys must be purged'):
+            self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_list_events_query_count(self):
+        self.login(permission='view')
+        for i, event in enumerate(self.events_list * 5):
+            Event.objects.create(
+                level=event.level, agent=event.agent, user=event.user,
+                description=f'More events {i}', details='details'
+            )
+
+        # The user and its permissions, then the events with their agent and
+        # user, whatever the number of events
+        with self.subTest('Agent and user must be loaded with the events'):
+            self.assertNumQueries(4, self.client.get, f'{self.route}')
+            self.assertNumQueries(4, self.client.get, f'{self.route}?cursor=&limit=100')
+            self.assertNumQueries(4, self.client.get, f'{self.route}{self.events_list[0].id}/')
+
+        with self.subTest('Offset pages must only add the count'):
+            self.assertNumQueries(5, self.client.get, f'{self.route}?limit=100')
+
+    def test_list_events_with_fields(self):
+        self.login(permission='view')
+        event = self.events_list[0]
+
+        def get(url):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            queries = [q['sql'] for q in context.captured_queries if 'FROM "logs_event"' in q['sql']]
+            return response, queries
+
+        response, queries = get(self.route)
+        with self.subTest('Details must not be read for the list'):
+            self.assertEqual(1, len(queries))
+            self.assertNotIn('"logs_event"."details"', queries[0])
+
+        response, queries = get(f'{self.route}?fields=id,level,datetime')
+        with self.subTest('Must only render and read the given fields', response=response):
+            self.assertEqual({'id', 'level', 'datetime'}, set(response.json()[0]))
+            self.assertNotIn('"logs_event"."description"', queries[0])
+            self.assertNotIn('JOIN', queries[0])
+
+        response, queries = get(f'{self.route}?fields=id,details,source&omit=source')
+        with self.subTest('Must leave out the omitted fields', response=response):
+            self.assertEqual({'id', 'details'}, set(response.json()[0]))
+            self.assertIn('"logs_event"."details"', queries[0])
+
+        response, queries = get(f'{self.route}{event.id}/?omit=details,collected_by')
+        with self.subTest('Must apply to a single event', response=response):
+            body = response.json()
+            self.assertEqual(event.description, body.get('description'))
+            self.assertEqual(event.source, body.get('source'))
+            self.assertNotIn('details', body)
+            self.assertNotIn('collected_by', body)
+            self.assertEqual(1, len(queries))
+
+        response = self.client.get(f'{self.route}{event.id}/')
+        with self.subTest('A single event must be complete by default', response=response):
+            self.assertEqual(event.details, response.json().get('details'))
+
+        response = self.client.get(f'{self.route}?fields=id,password')
+        with self.subTest('Unknown fields must return Bad Request', response=response):
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('password', response.json().get('detail'))
+
+    def test_list_events_matches_serializer(self):
+        self.login(permission='view')
+        now = timezone.now()
+        for i, event in enumerate(self.events_list):
+            event.datetime = now - timedelta(days=i, microseconds=i)
+            event.save()
+        # All fields, as the list leaves details out by default
+        fields = ','.join(EventModelSerializer().fields)
+
+        for time_zone in ['UTC', 'America/Sao_Paulo']:
+            with self.settings(TIME_ZONE=time_zone):
+                response = self.client.get(f'{self.route}?fields={fields}')
+                expected = EventModelSerializer(Event.objects.order_by('-datetime', '-id'), many=True).data
+
+            with self.subTest('The list must render events as the serializer', time_zone=time_zone):
+                self.assertEqual(json.loads(json.dumps(expected)), response.json())
+
+    def test_list_events_with_facets(self):
+        self.login(permission='view')
+        production = Agent.objects.create(environment='production', name='production agent')
+        for level in ['ERROR', 'ERROR', 'INFO']:
+            Event.objects.create(level=level, agent=production, description='facets', details='details')
+        self.events_list[0].archived = True
+        self.events_list[0].save()
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'{self.route}?archived=false&facets=level,environment,agent')
+        with self.subTest('Must count the filtered events per facet', response=response):
+            body = response.json()
+            events = Event.objects.filter(archived=False)
+            self.assertEqual(events.count(), len(body['results']))
+            self.assertEqual(
+                {'level', 'environment', 'agent'}, set(body['facets'])
+            )
+            self.assertEqual(
+                [{'value': 'ERROR', 'count': 4}, {'value': 'INFO', 'count': 3},
+                 {'value': 'WARNING', 'count': 2}, {'value': 'DEBUG', 'count': 1}],
+                body['facets']['level']
+            )
+            self.assertEqual(
+                [{'value': 'testing', 'count': 5}, {'value': 'production', 'count': 3},
+                 {'value': None, 'count': 2}],
+                body['facets']['environment']
+            )
+            self.assertEqual(
+                {agent: events.filter(agent=agent).count() for agent in events.values_list('agent', flat=True)},
+                {facet['value']: facet['count'] for facet in body['facets']['agent']}
+            )
+
+        with self.subTest('Facets must come from one query'):
+            self.assertEqual(1, len([q for q in context.captured_queries if 'GROUP BY' in q['sql']]))
+
+        response = self.client.get(f'{self.route}?search_by=level&search=error&facets=environment&limit=2')
+        with self.subTest('Must count the searched events beside a page', response=response):
+            body = response.json()
+            self.assertEqual(4, body['count'])
+            self.assertEqual(2, len(body['results']))
+            self.assertEqual(4, sum(facet['count'] for facet in body['facets']['environment']))
+
+        for facets in ['', ',']:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(f'{self.route}', {'facets': facets})
+            with self.subTest('Empty facets must not be counted', facets=facets, response=response):
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual({}, response.json()['facets'])
+                self.assertEqual([], [q for q in context.captured_queries if 'GROUP BY' in q['sql']])
+
+        response = self.client.get(f'{self.route}?facets=level,details')
+        with self.subTest('Unknown facets must return Bad Request', response=response):
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('details', response.json().get('facets'))
+
+    def test_events_stats(self):
+        day = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=2)
+        agent = self.events_list[0].agent
+        for hours, level in [(1, 'ERROR'), (1, 'ERROR'), (2, 'INFO'), (25, 'ERROR')]:
+            Event.objects.create(
+                level=level, description='stats', details='stats',
+                datetime=day + timedelta(hours=hours, minutes=30), agent=agent
+            )
+
+        response = self.client.get(f'{self.route}stats/')
+        with self.subTest('Must return Unauthorized', response=response):
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.login(permission='view')
+        response = self.client.get(f'{self.route}stats/', {'by': 'level'})
+        with self.subTest('Must count events per hour', response=response):
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual([
+                {'bucket': (day + timedelta(hours=1)).isoformat().replace('+00:00', 'Z'), 'level': 'ERROR', 'count': 2},
+                {'bucket': (day + timedelta(hours=2)).isoformat().replace('+00:00', 'Z'), 'level': 'INFO', 'count': 1},
+                {'bucket': (day + timedelta(hours=25)).isoformat().replace('+00:00', 'Z'), 'level': 'ERROR', 'count': 1},
+            ], response.json())
+
+        response = self.client.get(f'{self.route}stats/', {
+            'interval': 'day', 'by': 'environment,agent', 'level': 'ERROR',
+            'until': (day + timedelta(days=1)).isoformat()
+        })
+        with self.subTest('Must count the filtered events per day', response=response):
+            self.assertEqual([{
+                'bucket': day.isoformat().replace('+00:00', 'Z'),
+                'environment': 'testing', 'agent': agent.id, 'count': 2
+            }], response.json())
+
+        response = self.client.get(f'{self.route}stats/', {'by': 'details', 'interval': 'week'})
+        with self.subTest('Unknown groups and intervals must return Bad Request', response=response):
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('interval', response.json())
+
+    def test_search_events_full_text(self):
+        self.login(permission='view')
+        event = self.events_list[0]
+
+        def search(terms):
+            response = self.client.get(self.route, {'search_by': 'text', 'search': terms})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return sorted(item['id'] for item in response.json())
+
+        with self.subTest('Must search words of description and details'):
+            self.assertEqual([event.id], search('description 1'))
+            self.assertEqual([event.id], search('DETAILS 1'))
+            self.assertEqual([self.events_list[-3].id, self.events_list[-2].id], search('only'))
+            self.assertEqual([], search('descr'))
+
+        with self.subTest('Must not read search operators'):
+            self.assertEqual([], search('"description" OR NEAR( *'))
+
+        event.description = 'Database connection refused'
+        event.save()
+        with self.subTest('Must search the updated text'):
+            self.assertEqual([event.id], search('refused'))
+            self.assertEqual([], search('description 1'))
+
+        event.delete()
+        with self.subTest('Must not find deleted events'):
+            self.assertEqual([], search('refused'))
+
+    def test_search_events_by_substring(self):
+        self.login(permission='view')
+        agent = self.events_list[0].agent
+
+        def search(search_by, terms):
+            response = self.client.get(self.route, {'search_by': search_by, 'search': terms})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return sorted(item['id'] for item in response.json())
+
+        with self.subTest('Must search parts of words of the description'):
+            self.assertEqual([self.events_list[0].id], search('description', 'SCRIPTION 1'))
+            self.assertEqual([self.events_list[-3].id, self.events_list[-2].id], search('description', 'nly'))
+
+        with self.subTest('Must search parts of the agent name'):
+            self.assertEqual([self.events_list[0].id], search('source', 'GENT 1'))
+
+        with CaptureQueriesContext(connection) as context:
+            search('source', 'agent description')
+        with self.subTest('Must not scan the events with LIKE'):
+            self.assertFalse(any('LIKE' in query['sql'] for query in context.captured_queries))
+
+        agent.name = 'payments worker'
+        agent.save()
+        with self.subTest('Must search the updated agent name'):
+            self.assertEqual([self.events_list[0].id], search('source', 'ment'))
+            self.assertEqual([], search('source', 'gent 1'))
+
+    def test_list_events_with_cursor(self):
+        now = timezone.now()
+        agent = self.events_list[0].agent
+        for i in range(20):
+            # Repeated and missing datetimes must not skip or repeat events
+            datetime = None if i % 5 == 0 else now - timedelta(minutes=i // 3)
+            Event.objects.create(
+                level='INFO', description=f'paged {i}', details='details',
+                datetime=datetime, archived=i % 4 == 0, agent=agent
+            )
+        self.login(permission='view')
+
+        def walk(url, direction='next'):
+            ids, pages = [], 0
+            while url:
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                body = response.json()
+                self.assertNotIn('count', body)
+                self.assertLessEqual(len(body['results']), 4)
+                page_ids = [event['id'] for event in body['results']]
+                ids = ids + page_ids if direction == 'next' else page_ids + ids
+                queries = [q['sql'] for q in context.captured_queries if 'FROM "logs_event"' in q['sql']]
+                self.assertEqual(1, len(queries))
+                url, pages = body[direction], pages + 1
+            return ids, pages, body
+
+        events = Event.objects.values_list('id', flat=True)
+        orderings = {
+            '': events.order_by('-datetime', '-id'),
+            '&archived=false': events.filter(archived=False).order_by('-datetime', '-id'),
+            '&ordering=level': events.order_by('level', 'id'),
+            '&ordering=datetime': events.order_by('datetime', 'id'),
+        }
+        for query, expected in orderings.items():
+            expected = list(expected)
+            ids, pages, last_page = walk(f'{self.route}?cursor=&limit=4{query}')
+            with self.subTest('Pages must follow the list order', query=query):
+                self.assertEqual(expected, ids)
+                self.assertEqual(math.ceil(len(expected) / 4), pages)
+                self.assertIsNone(last_page['next'])
+
+            with self.subTest('Previous pages must lead back to the first', query=query):
+                ids, pages, first_page = walk(last_page['previous'], direction='previous')
+                self.assertEqual(expected[:-len(last_page['results'])], ids)
+                self.assertIsNone(first_page['previous'])
+
+        response = self.client.get(f'{self.route}?cursor=invalid')
+        with self.subTest('Invalid cursors must return Not Found', response=response):
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.get(f'{self.route}?limit=4&offset=4')
+        with self.subTest('Offset pagination must stay the default', response=response):
+            self.assertEqual(len(self.events_list) + 20, response.json().get('count'))
+
     def test_list_one_event(self):
         pk = len(self.events_list) + 2
 
@@ -412,3 +1197,46 @@ class EventRouteCase(TestCase, PermissionUtilities):
             db_events = Event.objects.count()
             self.assertEqual(total_events, db_events)
             self.assertRaises(Event.DoesNotExist, Event.objects.get, pk=pk)
+
+
+class EventStaleRelatedCase(TransactionTestCase):
+    """Foreign keys are only checked on commit, so inserts must be committed"""
+    route = '/api/events/'
+
+    def setUp(self):
+        related_cache.clear()
+        self.client = APIClient()
+        user = User.objects.create_superuser('all', 'all@email.com', 'all')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        self.agent = Agent.objects.create(environment='testing', name='agent')
+        self.stale = Agent.objects.create(environment='testing', name='stale')
+
+    def event(self, agent):
+        return {'level': 'ERROR', 'description': 'stale', 'details': 'stale', 'agent': agent.id}
+
+    def test_events_of_agents_deleted_by_another_process(self):
+        response = self.client.post(self.route, data=self.event(self.stale), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        Event.objects.all().delete()
+
+        # Another process deletes the agent: this one keeps it cached
+        stale = Agent(id=self.stale.id, environment='testing', name='stale')
+        self.stale.delete()
+        related_cache.set(('logs.Agent', stale.id), stale)
+
+        response = self.client.post(
+            f'{self.route}bulk/', data=[self.event(stale), self.event(self.agent)], format='json'
+        )
+        with self.subTest('Only the events of the deleted agent must fail', response=response):
+            self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+            body = response.json()
+            self.assertEqual(1, body.get('created'))
+            self.assertEqual([0], [error['index'] for error in body['errors']])
+            self.assertIn('does not exist', body['errors'][0]['errors']['agent'][0])
+            self.assertEqual([self.agent.id], list(Event.objects.values_list('agent', flat=True)))
+
+        related_cache.set(('logs.Agent', stale.id), stale)
+        response = self.client.post(self.route, data=self.event(stale), format='json')
+        with self.subTest('A single event of the deleted agent must fail', response=response):
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('does not exist', response.json()['agent'][0])
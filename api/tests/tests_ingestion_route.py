@@ -0,0 +1,39 @@
+from api.tests.TestCase import TestCase, PermissionUtilities
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from logs.models import Event
+
+
+class IngestionRouteCase(TestCase, PermissionUtilities):
+    route = '/api/ingestion/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.create_users_with_permissions(Event)
+
+    def test_ingestion_stats(self):
+        response = self.client.get(self.route)
+        with self.subTest('Must return Unauthorized', response=response):
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+            body = response.json()
+            self.assertIn('detail', body)
+            self.assertIn('authentication', body.get('detail').lower())
+
+        self.login(permission='view')
+        response = self.client.get(self.route)
+        with self.subTest('Must return Forbidden', response=response):
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+            body = response.json()
+            self.assertIn('detail', body)
+            self.assertIn('permission', body.get('detail').lower())
+
+        self.login(permission='all')
+        response = self.client.get(self.route)
+        with self.subTest('Must return the ingestion counters', response=response):
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            body = response.json()
+            self.assertEqual('sync', body.get('mode'))
+            for field in ['depth', 'capacity', 'flushed', 'last_flush_latency']:
+                self.assertIn(field, body.get('buffer'))
@@ -11,6 +11,7 @@ from api.auth import custom_token_obtain_pair
 router = routers.DefaultRouter()
 router.register(r'users', views.UserAPIViewSet)
 router.register(r'events', views.EventAPIViewSet)
+router.register(r'event-groups', views.EventGroupAPIViewSet)
 router.register(r'agents', views.AgentAPIViewSet)
 router.register(r'groups', views.GroupAPIViewSet)
 router.register(r'permissions', views.PermissionAPIViewSet)
@@ -26,5 +27,6 @@ urlpatterns = [
     path('refresh/', token_refresh, name='refresh-token'),
     path('register/', views.register, name='register'),
     path('recover/', views.request_recover, name='request-recover'),
-    path('reset/', views.reset_password, name='reset-password')
+    path('reset/', views.reset_password, name='reset-password'),
+    path('ingestion/', views.ingestion_stats, name='ingestion-stats')
 ]
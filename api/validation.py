@@ -0,0 +1,231 @@
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError
+
+from rest_framework import status
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.fields import SkipField, empty, get_error_detail
+from rest_framework.relations import PrimaryKeyRelatedField
+
+from api.auth import key_agent
+from api.idempotency import key_owner
+from api.quotas import apply_quotas
+from api.sampling import apply_sampling
+from api.serializers import EventModelSerializer, prefetch_related, related_cache
+from logs.ingestion import ingestion_setting, insert_events
+from logs.models import LEVELS, Agent, Event, User
+
+# Returned by the fast checks when the field must validate the value
+SLOW = object()
+
+
+def fast_level(value):
+    return value if type(value) is str and value in LEVELS else SLOW
+
+
+def fast_text(value):
+    if type(value) is not str:
+        return SLOW
+    value = value.strip()
+    return value if value and '\x00' not in value else SLOW
+
+
+def fast_boolean(value):
+    return value if type(value) is bool else SLOW
+
+
+def fast_nullable(value):
+    return None if value is None else SLOW
+
+
+FAST_CHECKS = {
+    'level': fast_level,
+    'description': fast_text,
+    'details': fast_text,
+    'archived': fast_boolean,
+    'datetime': fast_nullable,
+    'agent': fast_nullable,
+    'user': fast_nullable,
+}
+
+
+class EventValidator:
+    """Validate event payloads as EventModelSerializer, built only once.
+
+    Common values (known levels, non-blank strings, booleans, nulls) are
+    accepted by plain checks. Other values go through the serializer's own
+    fields, and payloads that are not plain dicts through the serializer, so
+    validated data and errors are the same as `serializer.is_valid()`.
+    """
+
+    def __init__(self):
+        serializer = EventModelSerializer()
+        self.fields = [
+            (name, field, FAST_CHECKS.get(name))
+            for name, field in serializer.fields.items() if not field.read_only
+        ]
+
+    def validate(self, data):
+        """Return (validated data, None) or (None, errors) of a payload"""
+        if type(data) is not dict:
+            serializer = EventModelSerializer(data=data)
+            if serializer.is_valid():
+                return serializer.validated_data, None
+            return None, serializer.errors
+
+        validated, errors = OrderedDict(), OrderedDict()
+        for name, field, fast_check in self.fields:
+            value = data.get(name, empty)
+            if value is not empty and fast_check is not None:
+                checked = fast_check(value)
+                if checked is not SLOW:
+                    validated[name] = checked
+                    continue
+
+            try:
+                validated[name] = field.run_validation(value)
+            except SkipField:
+                pass
+            except ValidationError as exc:
+                errors[name] = exc.detail
+            except DjangoValidationError as exc:
+                errors[name] = get_error_detail(exc)
+
+        if errors:
+            return None, errors
+        return validated, None
+
+
+event_validator = EventValidator()
+
+
+def bind_agent(item, agent_id):
+    """Return item with agent set to agent_id, and the error of another agent.
+
+    Requests authenticated by an agent key only add events of that agent.
+    """
+    if agent_id is None or not isinstance(item, dict):
+        return item, None
+
+    agent = item.get('agent')
+    if agent is not None:
+        try:
+            agent = Agent._meta.pk.to_python(agent)
+        except DjangoValidationError:
+            pass
+        if agent != agent_id:
+            return item, {'agent': ['Agent keys can only add events of their own agent.']}
+    # items() reads the last value of QueryDicts from form requests
+    return {**dict(item.items()), 'agent': agent_id}, None
+
+
+def validate_events(items, agent_id=None):
+    """Validate (index, item) pairs, returning (index, unsaved event) and errors.
+
+    With agent_id, items are bound to that agent first.
+    """
+    items, events, errors = list(items), [], []
+    if agent_id is not None:
+        bound = []
+        for index, item in items:
+            item, error = bind_agent(item, agent_id)
+            if error is None:
+                bound.append((index, item))
+            else:
+                errors.append({'index': index, 'errors': error})
+        items = bound
+
+    for model, name in [(Agent, 'agent'), (User, 'user')]:
+        prefetch_related(model, [
+            item.get(name) for index, item in items if isinstance(item, dict)
+        ])
+
+    for index, item in items:
+        if isinstance(item, ParseError):
+            errors.append({'index': index, 'errors': {'detail': item.detail}})
+            continue
+
+        validated_data, item_errors = event_validator.validate(item)
+        if item_errors is None:
+            events.append((index, Event(**validated_data)))
+        else:
+            errors.append({'index': index, 'errors': item_errors})
+
+    errors.sort(key=lambda error: error['index'])
+    return events, errors
+
+
+def accept_events(items, user):
+    """Validate items sent by user, then apply sampling and quotas.
+
+    Returns the events to insert, the errors and how many were sampled out.
+    """
+    events, errors = validate_events(items, key_agent(user))
+
+    events, sampled = apply_sampling(events)
+    events, over, wait = apply_quotas(events, key_owner(user))
+    if ingestion_setting('QUOTA_ACTION') == 'reject':
+        errors += [
+            {'index': index, 'errors': {'detail': 'Agent quota exceeded.'}}
+            for index, event in over
+        ]
+        errors.sort(key=lambda error: error['index'])
+
+    return events, errors, sampled
+
+
+def missing_related(items):
+    """Errors of the (index, event) items whose agent or user does not exist.
+
+    Their cached instances are dropped, as another process deleted them.
+    """
+    missing = {}
+    for model, name in [(Agent, 'agent'), (User, 'user')]:
+        ids = {getattr(event, f'{name}_id') for index, event in items} - {None}
+        missing[name] = ids - set(model.objects.filter(pk__in=ids).values_list('pk', flat=True))
+        for pk in missing[name]:
+            related_cache.pop((model._meta.label, pk))
+
+    message = PrimaryKeyRelatedField.default_error_messages['does_not_exist']
+    errors = []
+    for index, event in items:
+        item_errors = {
+            name: [message.format(pk_value=getattr(event, f'{name}_id'))]
+            for name in missing if getattr(event, f'{name}_id') in missing[name]
+        }
+        if item_errors:
+            errors.append({'index': index, 'errors': item_errors})
+    return errors
+
+
+def insert_accepted(items):
+    """Insert the events of (index, event) items.
+
+    When the insert fails as a cached agent or user was deleted, the events
+    referencing them are reported as errors and the others inserted.
+    Returns the inserted events and the errors.
+    """
+    try:
+        return insert_events([event for index, event in items]), []
+    except IntegrityError:
+        errors = missing_related(items)
+        if not errors:
+            raise
+
+    invalid = {error['index'] for error in errors}
+    events = []
+    for index, event in items:
+        if index not in invalid:
+            event.pk = None  # Set by the insert that was rolled back
+            events.append(event)
+    return insert_events(events), errors
+
+
+def bulk_status(created, rejected):
+    """Status of a bulk request: all, some or none of the events created"""
+    if not rejected:
+        return status.HTTP_201_CREATED
+    if created:
+        return status.HTTP_207_MULTI_STATUS
+    return status.HTTP_400_BAD_REQUEST
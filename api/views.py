@@ -1,37 +1,69 @@
-from rest_framework import viewsets, generics
+from itertools import islice
+
+from django.db import IntegrityError
+from django.db.models import Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from rest_framework import viewsets, generics, status
 
 from rest_framework.response import Response
 from rest_framework.decorators import (
-    api_view, authentication_classes, permission_classes
+    action, api_view, authentication_classes, permission_classes
 )
+from rest_framework.exceptions import Throttled, ValidationError
 
 from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
 
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.tokens import AccessToken
 
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
 
-from api.filters import EventFilterClass, EventSearchFilter
+from api.filters import (
+    EventFilterClass, EventGroupFilterClass, EventRollupFilterClass,
+    EventSearchFilter, facet_counts, facet_names
+)
 
 # I had to override DjangoModelPermissions to apply view permissions
 from api.permissions import DjangoModelPermissions, TokenUserMatchesUsername
 
-from api.auth import JWTAuthByQueryParams
+from api.auth import JWTAuthByQueryParams, AgentKeyAuthentication, key_agent
+from api.idempotency import idempotent, key_owner
+from api.listing import ValuesListModelMixin
+from api.pagination import KeysetPagination
+from api.parsers import MessagePackParser, NDJSONParser, NDJSONStream, msgpack
+from api.renderers import MessagePackRenderer
+from api.quotas import apply_quotas, dropped_counts
+from api.sampling import apply_sampling, sampling_counters
+from api.validation import (
+    accept_events, bind_agent, bulk_status, insert_accepted, missing_related
+)
 
-from logs.models import Permission, Group, User, Event, Agent
+from logs.models import Permission, Group, User, Event, EventGroup, EventRollup, Agent
+from logs.ingestion import ingestion_setting
+from logs.buffer import event_buffer
 
 from api.serializers import (
     PermissionModelSerializer, GroupModelSerializer,
     UserModelSerializer, EventModelSerializer, AgentModelSerializer,
+    EventGroupModelSerializer,
     UserCreateSerializer as RegisterSerializer,
     RecoverFormSerializer, ResetPasswordFormSerializer
 )
 
 from api.email_templates import subject, message, html_message
 
+# Agents sending many events may use MessagePack instead of JSON
+EVENT_PARSERS = list(api_settings.DEFAULT_PARSER_CLASSES)
+EVENT_RENDERERS = list(api_settings.DEFAULT_RENDERER_CLASSES)
+if msgpack is not None:
+    EVENT_PARSERS.append(MessagePackParser)
+    EVENT_RENDERERS.append(MessagePackRenderer)
+
 
 class PermissionAPIViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [IsAuthenticated, DjangoModelPermissions]
@@ -64,11 +96,16 @@ class UserAPIViewSet(viewsets.ModelViewSet):
     search_fields = ['username', 'email']
 
 
-class EventAPIViewSet(viewsets.ModelViewSet):
+class EventAPIViewSet(ValuesListModelMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, DjangoModelPermissions]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [JWTAuthentication, AgentKeyAuthentication]
+
+    parser_classes = EVENT_PARSERS
+    renderer_classes = EVENT_RENDERERS
+    pagination_class = KeysetPagination
 
-    queryset = Event.objects.all()
+    # source and collected_by are rendered from the agent and the user
+    queryset = Event.objects.select_related('agent', 'user')
     serializer_class = EventModelSerializer
 
     filter_backends = [
@@ -79,15 +116,229 @@ class EventAPIViewSet(viewsets.ModelViewSet):
     filterset_class = EventFilterClass
     search_fields = ['level', 'description', 'source']
     ordering_fields = ['level', 'datetime']
-    ordering = ['-datetime']
+    ordering = ['-datetime', '-id']
+
+    # Left out of the list unless asked in `fields`
+    list_omit = ['details']
+    # Columns not read from the database when they are not rendered
+    deferrable_fields = ['description', 'details']
+    # Relations loaded only to render a field
+    rendered_relations = {'source': 'agent', 'collected_by': 'user'}
+    # The list reads these values instead of Event instances
+    values_columns = {
+        'id': 'id', 'level': 'level', 'description': 'description',
+        'details': 'details', 'datetime': 'datetime', 'archived': 'archived',
+        'fingerprint': 'fingerprint', 'agent': 'agent_id', 'user': 'user_id',
+        'source': 'agent__name', 'collected_by': 'user__username',
+    }
+
+    def get_rendered_fields(self):
+        """Fields to render, from the `fields` and `omit` query params"""
+        if not hasattr(self, '_rendered_fields'):
+            names = list(self.serializer_class().fields)
+            params = self.request.query_params
+            if 'fields' in params:
+                fields = [name for name in params['fields'].split(',') if name]
+            elif self.action == 'list':
+                fields = [name for name in names if name not in self.list_omit]
+            else:
+                fields = names
+            omit = [name for name in params.get('omit', '').split(',') if name]
+
+            unknown = set(fields + omit) - set(names)
+            if unknown:
+                raise ValidationError({
+                    'detail': f'Unknown fields: {", ".join(sorted(unknown))}.'
+                })
+            self._rendered_fields = [name for name in fields if name not in omit]
+        return self._rendered_fields
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve'):
+            return queryset
+
+        fields = self.get_rendered_fields()
+        related = [
+            relation for name, relation in self.rendered_relations.items()
+            if name in fields
+        ]
+        queryset = queryset.select_related(None)
+        if related:
+            queryset = queryset.select_related(*related)
+        return queryset.defer(*[
+            name for name in self.deferrable_fields if name not in fields
+        ])
+
+    def list(self, request, *args, **kwargs):
+        if 'facets' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+
+        names = facet_names(request.query_params['facets'])
+        response = super().list(request, *args, **kwargs)
+        if isinstance(response.data, list):
+            response.data = {'results': response.data}
+        response.data['facets'] = facet_counts(self.filter_queryset(self.get_queryset()), names)
+        return response
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action in ('list', 'retrieve'):
+            kwargs.setdefault('fields', self.get_rendered_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        data, error = bind_agent(request.data, key_agent(request.user))
+        if error:
+            raise ValidationError(error)
+
+        serializer = self.get_serializer(data=data)
+        serializer.is_valid(raise_exception=True)
+
+        event = Event(**serializer.validated_data)
+        accepted, sampled = apply_sampling([(0, event)])
+        if sampled:
+            return Response(
+                {'detail': 'Event dropped by sampling.'},
+                status=status.HTTP_202_ACCEPTED
+            )
+
+        accepted, over, wait = apply_quotas(accepted, key_owner(request.user))
+        if over:
+            if ingestion_setting('QUOTA_ACTION') == 'reject':
+                raise Throttled(wait=wait)
+            return Response(
+                {'detail': 'Event dropped by quota.'},
+                status=status.HTTP_202_ACCEPTED
+            )
+
+        if ingestion_setting('MODE') == 'buffered':
+            if not event_buffer.put(event):
+                raise Throttled(wait=event_buffer.retry_after)
+
+            return Response(
+                {'detail': 'Event accepted.'}, status=status.HTTP_202_ACCEPTED
+            )
+
+        try:
+            self.perform_create(serializer)
+        except IntegrityError:
+            errors = missing_related([(0, event)])
+            if not errors:
+                raise
+            raise ValidationError(errors[0]['errors'])
+        headers = self.get_success_headers(serializer.data)
+        return Response(
+            serializer.data, status=status.HTTP_201_CREATED, headers=headers
+        )
 
+    def bulk_response(self, created, errors, rejected, sampled):
+        data = {
+            'created': created, 'rejected': rejected,
+            'sampled': sampled, 'errors': errors
+        }
+        return Response(data, status=bulk_status(created, rejected))
+
+    def bulk_stream(self, stream):
+        """Validate and commit a NDJSON body in fixed size chunks"""
+        chunk_size = ingestion_setting('STREAM_CHUNK_SIZE')
+        max_errors = ingestion_setting('STREAM_MAX_ERRORS')
+
+        items = iter(stream)
+        created, rejected, sampled, errors = 0, 0, 0, []
+        while True:
+            chunk = list(islice(items, chunk_size))
+            if not chunk:
+                break
+
+            events, chunk_errors, chunk_sampled = accept_events(chunk, self.request.user)
+            inserted, insert_errors = insert_accepted(events)
+            chunk_errors = sorted(chunk_errors + insert_errors, key=lambda error: error['index'])
+            created += len(inserted)
+            rejected += len(chunk_errors)
+            sampled += chunk_sampled
+            errors.extend(chunk_errors[:max_errors - len(errors)])
+
+        return self.bulk_response(created, errors, rejected, sampled)
+
+    @action(
+        detail=False, methods=['post'],
+        parser_classes=[*EVENT_PARSERS, NDJSONParser]
+    )
+    @idempotent
+    def bulk(self, request):
+        """Create many events at once, reporting the errors of each item"""
+        if isinstance(request.data, NDJSONStream):
+            return self.bulk_stream(request.data)
+
+        if not isinstance(request.data, list):
+            raise ValidationError({'detail': 'Expected a list of events.'})
+
+        max_size = ingestion_setting('BULK_MAX_SIZE')
+        if len(request.data) > max_size:
+            raise ValidationError({
+                'detail': f'Ensure this list has no more than {max_size} events.'
+            })
+
+        events, errors, sampled = accept_events(enumerate(request.data), request.user)
+        inserted, insert_errors = insert_accepted(events)
+        errors = sorted(errors + insert_errors, key=lambda error: error['index'])
+        created = len(inserted)
+
+        return self.bulk_response(created, errors, len(errors), sampled)
+
+    @action(detail=False, methods=['get'], filter_backends=[], pagination_class=None)
+    def stats(self, request):
+        """Event counts per hour or day, read from the EventRollup rows"""
+        filterset = EventRollupFilterClass(request.query_params, queryset=EventRollup.objects.all())
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+
+        intervals = {'hour': TruncHour, 'day': TruncDay}
+        interval = request.query_params.get('interval', 'hour')
+        if interval not in intervals:
+            raise ValidationError({'interval': f'Expected one of: {", ".join(intervals)}.'})
+
+        by = [name for name in request.query_params.get('by', '').split(',') if name]
+        unknown = set(by) - {'level', 'environment', 'agent'}
+        if unknown:
+            raise ValidationError({'by': f'Unknown fields: {", ".join(sorted(unknown))}.'})
+        by = list(dict.fromkeys(by))
+
+        rows = filterset.qs.order_by().values(
+            *by, time=intervals[interval]('bucket', tzinfo=timezone.utc)
+        ).annotate(count=Sum('count')).order_by('time', *by)
+
+        return Response([
+            {'bucket': row.pop('time'), **row} for row in rows
+        ])
+
+
+class EventGroupAPIViewSet(viewsets.ReadOnlyModelViewSet):
+    permission_classes = [IsAuthenticated, DjangoModelPermissions]
+    authentication_classes = [JWTAuthentication]
+    renderer_classes = EVENT_RENDERERS
+
+    queryset = EventGroup.objects.select_related('agent')
+    serializer_class = EventGroupModelSerializer
 
-class AgentAPIViewSet(viewsets.ModelViewSet):
+    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filterset_class = EventGroupFilterClass
+    search_fields = ['description']
+    ordering_fields = ['count', 'first_seen', 'last_seen']
+    ordering = ['-last_seen']
+
+
+class AgentAPIViewSet(ValuesListModelMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, DjangoModelPermissions]
     authentication_classes = [JWTAuthentication]
 
     queryset = Agent.objects.all()
     serializer_class = AgentModelSerializer
+    values_columns = {
+        'id': 'id', 'environment': 'environment', 'name': 'name',
+        'user': 'user_id', 'address': 'address',
+    }
 
     filter_backends = [DjangoFilterBackend, SearchFilter]
     filterset_fields = ['name', 'environment']
@@ -101,6 +352,19 @@ class RegisterAPIView(generics.CreateAPIView):
 register = RegisterAPIView.as_view()
 
 
+@api_view(['GET'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def ingestion_stats(request):
+    """Counters of the ingestion pipeline of the worker serving the request"""
+    return Response({
+        'mode': ingestion_setting('MODE'),
+        'buffer': event_buffer.stats(),
+        'quotas': {'dropped': dropped_counts()},
+        'sampling': sampling_counters()
+    })
+
+
 @api_view(['POST'])
 def request_recover(request):
     email = request.data.get('email', '')
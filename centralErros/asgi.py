@@ -2,6 +2,8 @@
 ASGI config for centralErros project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+POST /api/events/async/ is answered by an async ingestion application and
+every other request by Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -13,4 +15,11 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'centralErros.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up, as it loads the models
+from api.asgi import EventIngestionApplication, IngestionRouter  # noqa: E402
+
+application = IngestionRouter(
+    django_application, EventIngestionApplication(), '/api/events/async/'
+)
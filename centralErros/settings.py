@@ -49,12 +49,13 @@ INSTALLED_APPS = [
     'rest_framework',
     'django_filters',
     # Meus apps
-    'logs',
+    'logs.apps.LogsConfig',
     'api'
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.DecompressRequestMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -152,5 +153,34 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=2)
 }
 
+# Events ingestion
+# MODE 'sync' inserts events on request, 'buffered' queues them in memory and
+# a background thread, started by the first queued event, inserts them in
+# batches (requests get 202 or 429).
+# With SPOOL_DIR set, buffered events are also written to segment files there
+# until inserted, and replayed by the next worker to start if a worker dies.
+# MAX_DECOMPRESSED_SIZE limits gzip/deflate request bodies once inflated.
+# AGENT_QUOTA ({'rate': events per second, 'burst': events}) limits each agent,
+# and the events without agent of each user, and ENVIRONMENT_QUOTAS
+# ({environment: quota}) all agents of an environment.
+# Events over quota are rejected (429) or, with QUOTA_ACTION 'drop', dropped.
+# SAMPLING_RULES is a list of {'level', 'environment', 'agent', 'rate'}; the
+# first rule matching an event (missing keys match all) keeps only `rate` of
+# its events. Quota buckets are QuotaBucket rows, updated atomically; the
+# sampling and dropped events counters live in the CACHE cache, which must
+# be shared by the workers.
+# Responses to requests with an Idempotency-Key header are kept for
+# IDEMPOTENCY_TTL seconds (purge_idempotency_keys removes expired ones).
+# Retries of a request still in progress get 409 for at most
+# IDEMPOTENCY_LOCK_TIMEOUT seconds, a few times the request timeout, after
+# which the worker is presumed dead and the key is processed again.
+# Under ASGI, /api/events/async/ runs the database work in ASYNC_WORKERS
+# threads and inserts the events of concurrent requests together, at most
+# BUFFER_BATCH_SIZE events every ASYNC_FLUSH_INTERVAL seconds.
+# Keys left out take their value from DEFAULTS in logs/ingestion.py.
+EVENTS_INGESTION = {
+    'MODE': 'sync',
+}
+
 # Email testing
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
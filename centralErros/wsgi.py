@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'centralErros.settings')
 
 application = get_wsgi_application()
+
+# Imported once Django is set up, as it loads the models
+from logs.buffer import start_spool_replay  # noqa: E402
+
+start_spool_replay()
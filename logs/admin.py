@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from logs.models import Event, Agent
+from logs.models import Event, EventGroup, Agent, AgentKey
 
 
 class EventModelAdmin(admin.ModelAdmin):
@@ -10,5 +10,21 @@ class EventModelAdmin(admin.ModelAdmin):
     list_display = ('event', 'level', 'datetime', 'source', 'collected_by')
 
 
+class AgentKeyModelAdmin(admin.ModelAdmin):
+    list_display = ('prefix', 'agent', 'is_active', 'created_at')
+    fields = ('agent', 'prefix', 'is_active', 'created_at')
+    readonly_fields = ('agent', 'prefix', 'created_at')
+
+    def has_add_permission(self, request):
+        # Keys are created by the create_agent_key command
+        return False
+
+
+class EventGroupModelAdmin(admin.ModelAdmin):
+    list_display = ('description', 'level', 'source', 'count', 'last_seen')
+
+
 admin.site.register(Event, EventModelAdmin)
+admin.site.register(EventGroup, EventGroupModelAdmin)
 admin.site.register(Agent)
+admin.site.register(AgentKey, AgentKeyModelAdmin)
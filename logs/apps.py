@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class LogsConfig(AppConfig):
     name = 'logs'
+
+    def ready(self):
+        from logs import signals  # noqa: F401
+        from logs.search import restore_search_indexes
+
+        post_migrate.connect(restore_search_indexes, sender=self)
@@ -0,0 +1,204 @@
+import atexit
+import logging
+import math
+import queue
+import threading
+import time
+
+from django.db import IntegrityError, close_old_connections
+
+from logs.ingestion import ingestion_setting, insert_events
+from logs.spool import Spool, event_from_record, event_record
+
+logger = logging.getLogger(__name__)
+
+
+class EventBuffer:
+    """Bounded in-process queue of events written by a background thread.
+
+    Events are inserted in batches of `batch_size`, as soon as a batch is full
+    or at least every `flush_interval` seconds. `put` never blocks: when the
+    queue is full it returns False and the caller must apply backpressure.
+
+    With a `spool`, each event is appended to it before being queued and is
+    committed there once inserted. Batches that fail on a database error are
+    retried on the next flush; events left in the spool by a dead worker are
+    replayed when the thread starts, and after each flush until it succeeds.
+    Serving processes start it with `start_spool_replay`.
+
+    With `autostart`, the thread is started by the first `put`, so only the
+    processes receiving events run one.
+    """
+
+    def __init__(self, maxsize, batch_size, flush_interval, spool=None, autostart=False):
+        self.queue = queue.Queue(maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool = spool
+        self.autostart = autostart
+        self.pending = []
+
+        self.put_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+        self.replay_pending = spool is not None
+        self.flushes = 0
+        self.flushed = 0
+        self.failed = 0
+        self.replayed = 0
+        self.last_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    @property
+    def retry_after(self):
+        """Seconds a client should wait before retrying when the queue is full"""
+        return math.ceil(self.flush_interval)
+
+    def put(self, event):
+        with self.put_lock:
+            if self.autostart and self.thread is None and not self.stopped.is_set():
+                self.start()
+            if self.queue.full():
+                return False
+
+            position = self.spool.append(event_record(event)) if self.spool else None
+            self.queue.put_nowait((event, position))
+
+        if self.queue.qsize() >= self.batch_size:
+            self.wakeup.set()
+        return True
+
+    def insert(self, events):
+        """Insert events, skipping one by one those that break constraints"""
+        try:
+            insert_events(events)
+            return len(events)
+        except IntegrityError:
+            inserted = 0
+            for event in events:
+                try:
+                    insert_events([event])
+                    inserted += 1
+                except IntegrityError:
+                    logger.exception('Dropping buffered event %s', event_record(event))
+            return inserted
+
+    def flush(self):
+        """Insert one batch of queued events, returning its size"""
+        with self.lock:
+            batch, self.pending = self.pending, []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if not batch:
+                return 0
+
+            start = time.monotonic()
+            try:
+                inserted = self.insert([event for event, position in batch])
+            except Exception:
+                logger.exception('Could not insert %d buffered events', len(batch))
+                self.pending = batch
+                return 0
+            finally:
+                self.last_flush_latency = time.monotonic() - start
+                self.total_flush_latency += self.last_flush_latency
+                self.flushes += 1
+
+            self.flushed += inserted
+            self.failed += len(batch) - inserted
+            if self.spool:
+                self.spool.commit(batch[-1][1])
+
+            return len(batch)
+
+    def replay(self):
+        """Insert the events a dead worker left in the spool"""
+        def insert(records):
+            self.replayed += self.insert([event_from_record(r) for r in records])
+
+        try:
+            self.spool.replay(insert, self.batch_size)
+            self.replay_pending = False
+        except Exception:
+            logger.exception('Could not replay the events spool')
+
+    def flush_all(self):
+        while self.flush() == self.batch_size:
+            pass
+
+    def run(self):
+        while not self.stopped.is_set():
+            if self.replay_pending:
+                self.replay()
+                close_old_connections()
+
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush_all()
+            close_old_connections()
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.thread = threading.Thread(
+            target=self.run, name='event-buffer', daemon=True
+        )
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush_all()
+
+    def stats(self):
+        average = self.total_flush_latency / self.flushes if self.flushes else 0.0
+        return {
+            'running': self.thread is not None,
+            'depth': self.queue.qsize() + len(self.pending),
+            'capacity': self.queue.maxsize,
+            'flushed': self.flushed,
+            'failed': self.failed,
+            'replayed': self.replayed,
+            'flushes': self.flushes,
+            'last_flush_latency': self.last_flush_latency,
+            'average_flush_latency': average,
+            'spool': self.spool.stats() if self.spool else None,
+        }
+
+
+def start_spool_replay():
+    """Start the buffer thread of a serving process if it has a spool.
+
+    Events left by dead workers are then replayed as the worker starts,
+    instead of when it queues its first event.
+    """
+    if event_buffer.spool is not None:
+        event_buffer.start()
+
+
+def spool_from_settings():
+    directory = ingestion_setting('SPOOL_DIR')
+    if not directory:
+        return None
+    return Spool(directory, ingestion_setting('SPOOL_SEGMENT_SIZE'))
+
+
+event_buffer = EventBuffer(
+    maxsize=ingestion_setting('BUFFER_SIZE'),
+    batch_size=ingestion_setting('BUFFER_BATCH_SIZE'),
+    flush_interval=ingestion_setting('BUFFER_FLUSH_INTERVAL'),
+    spool=spool_from_settings(),
+    autostart=True
+)
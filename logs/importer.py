@@ -0,0 +1,170 @@
+import csv
+import io
+import json
+import os
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from logs.ingestion import after_insert
+from logs.models import Agent, Event, User, event_fingerprint
+
+FORMATS = ['csv', 'ndjson']
+VALUE_FIELDS = ['level', 'description', 'details', 'datetime', 'archived']
+RELATED_FIELDS = {'agent': Agent, 'user': User}
+
+
+def guess_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    return 'csv' if extension == '.csv' else 'ndjson'
+
+
+def read_rows(path, format):
+    """Yield (line number, row dict or parse error) from a CSV or NDJSON file"""
+    with open(path, newline='', encoding='utf-8') as file:
+        if format == 'csv':
+            reader = csv.DictReader(file)
+            for row in reader:
+                yield reader.line_num, row
+            return
+
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                row = f'Invalid JSON - {exc}'
+            else:
+                if not isinstance(row, dict):
+                    row = 'Expected a JSON object.'
+            yield number, row
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def clean_row(row):
+    """Return the column values of row, raising ValidationError when invalid.
+
+    Related ids are converted but not checked, as workers have no database
+    connection; see `missing_related`.
+    """
+    values, errors = {}, {}
+    for name in VALUE_FIELDS:
+        field = Event._meta.get_field(name)
+        value = row.get(name)
+        if value in (None, '') and field.has_default():
+            value = field.get_default()
+        elif value == '' and field.null:
+            value = None
+        elif isinstance(value, str) and field.get_internal_type() == 'BooleanField':
+            value = value.strip().capitalize()  # 'true' as 'True'
+
+        try:
+            values[name] = field.clean(value, None)
+        except ValidationError as exc:
+            errors[name] = exc.messages
+
+    for name in RELATED_FIELDS:
+        field = Event._meta.get_field(name)
+        value = row.get(name)
+        try:
+            values[field.attname] = (
+                None if value in (None, '') else field.target_field.to_python(value)
+            )
+        except ValidationError as exc:
+            errors[name] = exc.messages
+
+    if errors:
+        raise ValidationError(errors)
+
+    if values['datetime'] and timezone.is_naive(values['datetime']):
+        values['datetime'] = timezone.make_aware(values['datetime'])
+    values['fingerprint'] = event_fingerprint(
+        values['level'], values['agent_id'], values['description']
+    )
+    return values
+
+
+def validate_chunk(chunk):
+    """Clean (line, row) items, returning valid values and (line, errors)"""
+    valid, errors = [], []
+    for line, row in chunk:
+        if isinstance(row, str):
+            errors.append((line, {'detail': [row]}))
+            continue
+        try:
+            valid.append((line, clean_row(row)))
+        except ValidationError as exc:
+            errors.append((line, exc.message_dict))
+    return valid, errors
+
+
+def missing_related(valid):
+    """Split out rows pointing to missing agents or users, one query per model"""
+    missing = {}
+    for name, model in RELATED_FIELDS.items():
+        ids = {values[f'{name}_id'] for _, values in valid} - {None}
+        found = set(model.objects.filter(pk__in=ids).values_list('pk', flat=True))
+        missing[name] = ids - found
+
+    kept, errors = [], []
+    for line, values in valid:
+        invalid = {
+            name: [f'Invalid pk "{values[f"{name}_id"]}" - object does not exist.']
+            for name in RELATED_FIELDS if values[f'{name}_id'] in missing[name]
+        }
+        if invalid:
+            errors.append((line, invalid))
+        else:
+            kept.append(values)
+    return kept, errors
+
+
+def copy_value(value):
+    """Format value for the text format of PostgreSQL COPY"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return (
+        str(value).replace('\\', '\\\\').replace('\t', '\\t')
+        .replace('\n', '\\n').replace('\r', '\\r')
+    )
+
+
+def copy_events(events):
+    fields = [field for field in Event._meta.concrete_fields if not field.primary_key]
+    buffer = io.StringIO()
+    for event in events:
+        buffer.write('\t'.join(
+            copy_value(getattr(event, field.attname)) for field in fields
+        ))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    table = connection.ops.quote_name(Event._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY {table} ({columns}) FROM STDIN', buffer)
+
+
+def load_events(values):
+    """Insert cleaned rows with COPY on PostgreSQL or bulk_create otherwise"""
+    events = [Event(**row) for row in values]
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            copy_events(events)
+        else:
+            Event.objects.bulk_create(events)
+        after_insert(events)
+    return len(events)
@@ -0,0 +1,183 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.utils import timezone
+
+from logs.models import Agent, Event, EventGroup, EventRollup
+
+DEFAULTS = {
+    'MODE': 'sync',
+    'BUFFER_SIZE': 10000,
+    'BUFFER_BATCH_SIZE': 500,
+    'BUFFER_FLUSH_INTERVAL': 1.0,
+    'SPOOL_DIR': None,
+    'SPOOL_SEGMENT_SIZE': 16 * 1024 * 1024,
+    'BULK_MAX_SIZE': 1000,
+    'STREAM_CHUNK_SIZE': 500,
+    'STREAM_MAX_ERRORS': 100,
+    'MAX_DECOMPRESSED_SIZE': 10 * 1024 * 1024,
+    'AGENT_QUOTA': None,
+    'ENVIRONMENT_QUOTAS': {},
+    'QUOTA_ACTION': 'reject',
+    'SAMPLING_RULES': [],
+    'IDEMPOTENCY_TTL': 24 * 60 * 60,
+    'IDEMPOTENCY_LOCK_TIMEOUT': 5 * 60,
+    'ASYNC_WORKERS': 4,
+    'ASYNC_FLUSH_INTERVAL': 0.05,
+    'CACHE': 'default',
+}
+
+
+def ingestion_setting(name):
+    """Return EVENTS_INGESTION[name] from settings or its default value"""
+    return getattr(settings, 'EVENTS_INGESTION', {}).get(name, DEFAULTS[name])
+
+
+def shared_cache():
+    """Cache holding the state shared by all workers, as quotas and counters"""
+    return caches[ingestion_setting('CACHE')]
+
+
+def insert_events(events):
+    """Insert unsaved Event instances with a single batched write"""
+    if not events:
+        return []
+
+    for event in events:
+        event.set_fingerprint()
+
+    with transaction.atomic():
+        events = Event.objects.bulk_create(events)
+        after_insert(events)
+    return events
+
+
+def after_insert(events):
+    """Update the tables derived from events once they are inserted"""
+    update_groups(events)
+    update_rollups(events)
+
+
+UPSERT_GROUPS = """
+    INSERT INTO {table} (
+        fingerprint, level, description, agent_id, first_seen, last_seen, {count}
+    )
+    VALUES {values}
+    ON CONFLICT (fingerprint) DO UPDATE SET
+        {count} = {table}.{count} + excluded.{count},
+        first_seen = {least}({table}.first_seen, excluded.first_seen),
+        last_seen = {greatest}({table}.last_seen, excluded.last_seen)
+"""
+
+UPSERT_BATCH_SIZE = 100
+
+
+def update_groups(events):
+    """Add events to the occurrences of their EventGroup.
+
+    Events are aggregated by fingerprint first, so each group is upserted
+    once per call, in fingerprint order to avoid deadlocks.
+    """
+    groups = {}
+    now = timezone.now()
+    for event in events:
+        seen = event.datetime or now
+        group = groups.get(event.fingerprint)
+        if group is None:
+            groups[event.fingerprint] = [
+                event.level, event.description, event.agent_id, seen, seen, 1
+            ]
+        else:
+            group[3] = min(group[3], seen)
+            group[4] = max(group[4], seen)
+            group[5] += 1
+
+    if connection.vendor == 'postgresql':
+        least, greatest = 'LEAST', 'GREATEST'
+    else:
+        least, greatest = 'MIN', 'MAX'
+
+    rows = sorted(groups.items())
+    adapt = connection.ops.adapt_datetimefield_value
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            params = []
+            for fingerprint, (level, description, agent_id, first, last, count) in batch:
+                params += [
+                    fingerprint, level, description, agent_id,
+                    adapt(first), adapt(last), count
+                ]
+
+            cursor.execute(UPSERT_GROUPS.format(
+                table=connection.ops.quote_name(EventGroup._meta.db_table),
+                count=connection.ops.quote_name('count'),
+                values=', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(batch)),
+                least=least, greatest=greatest
+            ), params)
+
+
+UPSERT_ROLLUPS = """
+    INSERT INTO {table} (bucket, level, agent_id, environment, {count})
+    VALUES {values}
+    ON CONFLICT ({conflict}) WHERE agent_id IS {agent} DO UPDATE SET
+        {count} = {table}.{count} + excluded.{count}
+"""
+
+
+def rollup_bucket(datetime):
+    """Start of the UTC hour of datetime"""
+    if timezone.is_naive(datetime):
+        datetime = timezone.make_aware(datetime)
+    return datetime.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def update_rollups(events):
+    """Add events to the EventRollup rows of their hour, level and agent.
+
+    Events without datetime have no hour and are not counted, as in
+    backfill_event_rollups. Rows are upserted in key order to avoid
+    deadlocks, those without agent in their own statement as they match
+    another unique index.
+    """
+    events = [event for event in events if event.datetime is not None]
+    environments, missing = {}, set()
+    for event in events:
+        if event.agent_id is None:
+            continue
+        if Event.agent.is_cached(event):
+            environments[event.agent_id] = event.agent.environment
+        else:
+            missing.add(event.agent_id)
+    missing -= set(environments)
+    if missing:
+        environments.update(Agent.objects.filter(id__in=missing).values_list('id', 'environment'))
+
+    rollups = {}
+    for event in events:
+        key = (
+            rollup_bucket(event.datetime), event.level, event.agent_id,
+            environments.get(event.agent_id, '')
+        )
+        rollups[key] = rollups.get(key, 0) + 1
+
+    adapt = connection.ops.adapt_datetimefield_value
+    with_agent = sorted(item for item in rollups.items() if item[0][2] is not None)
+    without_agent = sorted(item for item in rollups.items() if item[0][2] is None)
+    with connection.cursor() as cursor:
+        for rows, conflict, agent in [
+            (with_agent, 'bucket, level, agent_id, environment', 'NOT NULL'),
+            (without_agent, 'bucket, level, environment', 'NULL'),
+        ]:
+            for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+                batch = rows[start:start + UPSERT_BATCH_SIZE]
+                params = []
+                for (bucket, level, agent_id, environment), count in batch:
+                    params += [adapt(bucket), level, agent_id, environment, count]
+
+                cursor.execute(UPSERT_ROLLUPS.format(
+                    table=connection.ops.quote_name(EventRollup._meta.db_table),
+                    count=connection.ops.quote_name('count'),
+                    values=', '.join(['(%s, %s, %s, %s, %s)'] * len(batch)),
+                    conflict=conflict, agent=agent
+                ), params)
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Value
+from django.db.models.functions import Coalesce, TruncHour
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from logs.ingestion import rollup_bucket
+from logs.models import Event, EventRollup
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the EventRollup rows from the events, all of them or from '
+        'the hour of --since on. Run it once after migrating, or when events '
+        'were updated or deleted; inserts running meanwhile may be counted twice.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Rebuild the hours from this ISO datetime on')
+
+    def handle(self, *args, **options):
+        rollups = EventRollup.objects.all()
+        events = Event.objects.filter(datetime__isnull=False)
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError(f'Invalid datetime "{options["since"]}".')
+            since = rollup_bucket(since)
+            rollups = rollups.filter(bucket__gte=since)
+            events = events.filter(datetime__gte=since)
+
+        groups = events.order_by().values(
+            'level', 'agent', bucket=TruncHour('datetime', tzinfo=timezone.utc),
+            environment=Coalesce('agent__environment', Value('')),
+        ).annotate(count=Count('id'))
+
+        created = 0
+        with transaction.atomic():
+            deleted, _ = rollups.delete()
+            batch = []
+            for group in groups.iterator():
+                batch.append(EventRollup(
+                    bucket=group['bucket'], level=group['level'], agent_id=group['agent'],
+                    environment=group['environment'], count=group['count']
+                ))
+                if len(batch) == BATCH_SIZE:
+                    created += len(EventRollup.objects.bulk_create(batch))
+                    batch = []
+            created += len(EventRollup.objects.bulk_create(batch))
+
+        self.stdout.write(f'{deleted} rollups deleted, {created} created.')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from logs.models import Agent, AgentKey
+
+
+class Command(BaseCommand):
+    help = 'Create a key for an agent to send events. The key is shown only once.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('agent_id', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            agent = Agent.objects.get(pk=options['agent_id'])
+        except Agent.DoesNotExist:
+            raise CommandError(f'Agent {options["agent_id"]} does not exist.')
+
+        _, key = AgentKey.generate(agent)
+        self.stdout.write(f'Key for {agent}: {key}')
+        self.stdout.write('Send it in the header "Authorization: Agent <key>".')
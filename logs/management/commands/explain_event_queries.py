@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from api.filters import EventFilterClass
+from logs.models import Event
+
+# Filters and orderings used by the events dashboard
+QUERIES = [
+    ('Not archived, newest first', {'archived': 'false'}, ['-datetime', '-id']),
+    ('Not archived in production, newest first', {'archived': 'false', 'environment': 'production'}, ['-datetime', '-id']),
+    ('All, newest first', {}, ['-datetime', '-id']),
+    ('All, by level', {}, ['level']),
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Show the query plans of the events list with and without the Event '
+        'indexes. The indexes are dropped inside a transaction that is rolled '
+        'back; on PostgreSQL it locks the events table meanwhile.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help='Run the queries to show their actual time (PostgreSQL)'
+        )
+        parser.add_argument('--limit', type=int, default=50, help='Rows of a page')
+
+    def explain(self, title, options):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'== {title} =='))
+        explain_options = {'analyze': True} if options['analyze'] else {}
+        prefix = connection.ops.explain_query_prefix(**explain_options)
+
+        for name, data, ordering in QUERIES:
+            queryset = EventFilterClass(data, Event.objects.all()).qs.order_by(*ordering)
+            sql, params = queryset[:options['limit']].query.sql_with_params()
+
+            # The title makes the statement differ from the previous run, as
+            # SQLite would reuse its cached plan
+            with connection.cursor() as cursor:
+                cursor.execute(f'{prefix} {sql} /* {title} */', params)
+                plan = [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+
+            self.stdout.write(self.style.SQL_FIELD(name))
+            self.stdout.write('\n'.join(plan))
+            self.stdout.write('')
+
+    def handle(self, *args, **options):
+        self.explain('With indexes', options)
+
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                # Run as plain statements, as the SQLite schema editor can not
+                # be used inside a transaction
+                editor = connection.schema_editor()
+                for index in Event._meta.indexes:
+                    cursor.execute(str(index.remove_sql(Event, editor)))
+                self.explain('Without indexes', options)
+                raise Rollback()
+        except Rollback:
+            pass
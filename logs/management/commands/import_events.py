@@ -0,0 +1,112 @@
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from logs.importer import (
+    FORMATS, chunks, guess_format, load_events, missing_related, read_rows,
+    validate_chunk
+)
+
+
+class InlineExecutor:
+    """Run validation in this process when no workers are requested"""
+
+    def submit(self, function, *args):
+        return InlineResult(function(*args))
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class InlineResult:
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+class Command(BaseCommand):
+    help = (
+        'Import events from CSV or NDJSON files. Rows are validated by a pool '
+        'of processes and loaded with COPY on PostgreSQL or bulk inserts otherwise.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', metavar='path')
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help='Format of the files, by default guessed by the extension'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=multiprocessing.cpu_count(),
+            help='Processes validating rows, 0 validates in this process'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Rows validated and loaded at a time'
+        )
+        parser.add_argument(
+            '--max-errors', type=int, default=100,
+            help='Stop after this many invalid rows'
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] > 0:
+            # Spawned workers never share the database connections of this process
+            executor = ProcessPoolExecutor(
+                options['workers'], mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup
+            )
+        else:
+            executor = InlineExecutor()
+
+        self.imported = self.invalid = 0
+        started_at = time.monotonic()
+        try:
+            for path in options['paths']:
+                self.import_file(path, executor, options)
+        finally:
+            executor.shutdown(wait=True)
+
+        elapsed = max(time.monotonic() - started_at, 1e-6)
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {self.imported} events ({self.invalid} invalid) in '
+            f'{elapsed:.2f}s, {self.imported / elapsed:.0f} rows/s.'
+        ))
+
+    def import_file(self, path, executor, options):
+        format = options['format'] or guess_format(path)
+        try:
+            rows = read_rows(path, format)
+            batches = chunks(rows, options['batch_size'])
+
+            # Keep a few batches in flight, so reading, validating and
+            # loading overlap without holding the whole file in memory
+            pending = deque()
+            for batch in batches:
+                pending.append(executor.submit(validate_chunk, batch))
+                if len(pending) > max(options['workers'], 1):
+                    self.load(path, pending.popleft().result(), options)
+            while pending:
+                self.load(path, pending.popleft().result(), options)
+        except OSError as exc:
+            raise CommandError(f'Could not read {path}: {exc}')
+
+    def load(self, path, result, options):
+        valid, errors = result
+        valid, missing = missing_related(valid)
+        errors = sorted(errors + missing)
+
+        for line, messages in errors:
+            self.stderr.write(f'{path}:{line}: {messages}')
+        self.invalid += len(errors)
+        if self.invalid > options['max_errors']:
+            raise CommandError(f'Stopped after {self.invalid} invalid rows.')
+
+        self.imported += load_events(valid)
+        self.stdout.write(f'{path}: {self.imported} events imported')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from logs.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Delete the expired responses stored for Idempotency-Key headers.'
+
+    def handle(self, *args, **options):
+        deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+        self.stdout.write(f'{deleted} expired keys deleted.')
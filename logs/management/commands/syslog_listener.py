@@ -0,0 +1,75 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from logs.syslog import SyslogCollector, SyslogTCPProtocol, SyslogUDPProtocol
+
+
+class Command(BaseCommand):
+    help = 'Receive syslog messages over UDP and TCP and store them as events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=5140)
+        parser.add_argument('--no-udp', action='store_true', help='Do not listen on UDP')
+        parser.add_argument('--no-tcp', action='store_true', help='Do not listen on TCP')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Insert a batch once it has this many messages'
+        )
+        parser.add_argument(
+            '--flush-interval', type=float, default=1.0,
+            help='Insert pending messages at least every this many seconds'
+        )
+        parser.add_argument(
+            '--max-pending', type=int, default=10000,
+            help='Drop the messages received while this many wait to be inserted'
+        )
+
+    def handle(self, *args, **options):
+        # A single thread keeps the inserts ordered on one connection
+        executor = ThreadPoolExecutor(max_workers=1)
+        collector = SyslogCollector(
+            options['batch_size'], options['flush_interval'], executor,
+            max_pending=options['max_pending']
+        )
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.listen(loop, collector, options))
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+
+            loop.run_until_complete(collector.drain())
+            executor.shutdown(wait=True)
+            loop.close()
+
+        self.stdout.write(
+            f'Received {collector.received} messages, '
+            f'inserted {collector.inserted} events, dropped {collector.dropped}.'
+        )
+
+    async def listen(self, loop, collector, options):
+        host, port = options['host'], options['port']
+
+        if not options['no_udp']:
+            await loop.create_datagram_endpoint(
+                lambda: SyslogUDPProtocol(collector), local_addr=(host, port)
+            )
+            self.stdout.write(f'Listening for syslog on udp://{host}:{port}')
+
+        if not options['no_tcp']:
+            await loop.create_server(
+                lambda: SyslogTCPProtocol(collector), host, port
+            )
+            self.stdout.write(f'Listening for syslog on tcp://{host}:{port}')
+
+        loop.create_task(collector.flush_periodically())
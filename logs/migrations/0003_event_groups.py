@@ -0,0 +1,71 @@
+# Generated by Django 3.0.7 on 2026-10-18 08:52
+
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+import logs.models
+
+
+def group_existing_events(apps, schema_editor):
+    Event = apps.get_model('logs', 'Event')
+    EventGroup = apps.get_model('logs', 'EventGroup')
+
+    now = timezone.now()
+    groups = {}
+    changed = []
+    for event in Event.objects.order_by('id').iterator(chunk_size=1000):
+        event.fingerprint = logs.models.event_fingerprint(
+            event.level, event.agent_id, event.description
+        )
+        changed.append(event)
+        if len(changed) == 1000:
+            Event.objects.bulk_update(changed, ['fingerprint'])
+            changed = []
+
+        seen = event.datetime or now
+        group = groups.get(event.fingerprint)
+        if group is None:
+            groups[event.fingerprint] = EventGroup(
+                fingerprint=event.fingerprint, level=event.level,
+                description=event.description, agent_id=event.agent_id,
+                first_seen=seen, last_seen=seen, count=1
+            )
+        else:
+            group.first_seen = min(group.first_seen, seen)
+            group.last_seen = max(group.last_seen, seen)
+            group.count += 1
+
+    Event.objects.bulk_update(changed, ['fingerprint'])
+    EventGroup.objects.bulk_create(groups.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0002_agentkey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='fingerprint',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=40),
+        ),
+        migrations.CreateModel(
+            name='EventGroup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=40, unique=True)),
+                ('level', models.CharField(choices=[('CRITICAL', 'CRITICAL'), ('DEBUG', 'DEBUG'), ('ERROR', 'ERROR'), ('WARNING', 'WARNING'), ('INFO', 'INFO')], max_length=20)),
+                ('description', models.TextField()),
+                ('first_seen', models.DateTimeField()),
+                ('last_seen', models.DateTimeField(db_index=True)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('agent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='logs.Agent')),
+            ],
+            options={
+                'ordering': ['-last_seen'],
+            },
+        ),
+        migrations.RunPython(group_existing_events, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.0.7 on 2026-10-18 09:40
+
+from django.db import migrations
+
+import logs.search
+
+
+def install_full_text(apps, schema_editor):
+    logs.search.install_full_text(schema_editor.connection)
+
+
+def uninstall_full_text(apps, schema_editor):
+    logs.search.uninstall_full_text(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0005_event_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_full_text, uninstall_full_text),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.0.7 on 2026-10-18 10:05
+
+from django.db import migrations
+
+import logs.search
+
+
+def install_trigram(apps, schema_editor):
+    logs.search.install_trigram(schema_editor.connection)
+
+
+def uninstall_trigram(apps, schema_editor):
+    logs.search.uninstall_trigram(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0006_event_full_text'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_trigram, uninstall_trigram),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.0.7 on 2026-10-18 10:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0009_idempotencykey_locked_until'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='event',
+            name='agent',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='logs.Agent'),
+        ),
+    ]
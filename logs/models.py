@@ -1,3 +1,7 @@
+import hashlib
+import re
+import secrets
+
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
@@ -30,6 +34,31 @@ class Agent(models.Model):
         return f'{self.name} ({self.environment})'
 
 
+def hash_agent_key(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class AgentKey(models.Model):
+    """Secret used by an agent to send events. Only its hash is stored."""
+    agent = models.ForeignKey(Agent, on_delete=models.CASCADE, related_name='keys')
+    prefix = models.CharField(max_length=8)
+    hashed_key = models.CharField(max_length=64, unique=True)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def generate(cls, agent):
+        """Create a key for agent, returning it and the raw key"""
+        key = secrets.token_urlsafe(32)
+        instance = cls.objects.create(
+            agent=agent, prefix=key[:8], hashed_key=hash_agent_key(key)
+        )
+        return instance, key
+
+    def __str__(self):
+        return f'{self.prefix}... ({self.agent})'
+
+
 def validate_level(value):
     if value not in LEVELS:
         raise ValidationError(
@@ -38,6 +67,26 @@ def validate_level(value):
         )
 
 
+NORMALIZATIONS = [
+    (re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'), '<uuid>'),
+    (re.compile(r'0x[0-9a-f]+'), '<hex>'),
+    (re.compile(r'\d+'), '<n>'),
+]
+
+
+def event_fingerprint(level, agent_id, description):
+    """Hash identifying events of the same problem.
+
+    Case, whitespace, numbers, hex values and uuids are ignored in the
+    description, so occurrences that only differ by ids or counters match.
+    """
+    normalized = ' '.join(description.lower().split())
+    for pattern, replacement in NORMALIZATIONS:
+        normalized = pattern.sub(replacement, normalized)
+
+    return hashlib.sha1(f'{level}|{agent_id}|{normalized}'.encode()).hexdigest()
+
+
 class Event(models.Model):
     LEVEL_CHOICES = [(level, level) for level in LEVELS]
     level = models.CharField(
@@ -47,9 +96,20 @@ class Event(models.Model):
     description = models.TextField()
     details = models.TextField()
     datetime = models.DateTimeField(blank=True, null=True)
-    agent = models.ForeignKey(Agent, on_delete=models.SET_NULL, null=True, blank=True)
+    # Lookups by agent use event_agent_datetime_idx
+    agent = models.ForeignKey(Agent, on_delete=models.SET_NULL, null=True, blank=True, db_index=False)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     archived = models.BooleanField(default=False)
+    fingerprint = models.CharField(max_length=40, blank=True, db_index=True, editable=False)
+
+    def set_fingerprint(self):
+        self.fingerprint = event_fingerprint(self.level, self.agent_id, self.description)
+
+    def save(self, *args, **kwargs):
+        # Only on insert, as the occurrences of groups are counted on insert
+        if self._state.adding:
+            self.set_fingerprint()
+        super().save(*args, **kwargs)
 
     @property
     def source(self):
@@ -64,3 +124,104 @@ class Event(models.Model):
 
     class Meta:
         ordering = ['datetime']
+        # Match the filters and orderings of the events list
+        indexes = [
+            models.Index(fields=['archived', 'datetime'], name='event_archived_datetime_idx'),
+            models.Index(fields=['level', 'datetime'], name='event_level_datetime_idx'),
+            models.Index(fields=['agent', 'datetime'], name='event_agent_datetime_idx'),
+            models.Index(fields=['datetime', 'id'], name='event_datetime_id_idx'),
+        ]
+
+
+class EventGroup(models.Model):
+    """Occurrences of the events sharing a fingerprint.
+
+    Events are counted when inserted: updated events keep the fingerprint
+    of their insert and deleted events are still counted.
+    """
+    fingerprint = models.CharField(max_length=40, unique=True)
+    level = models.CharField(max_length=20, choices=Event.LEVEL_CHOICES)
+    description = models.TextField()
+    agent = models.ForeignKey(Agent, on_delete=models.SET_NULL, null=True, blank=True)
+    first_seen = models.DateTimeField()
+    last_seen = models.DateTimeField(db_index=True)
+    count = models.PositiveIntegerField(default=0)
+
+    @property
+    def source(self):
+        return self.agent.name if self.agent else None
+
+    def __str__(self):
+        return f'{self.level} - {self.description} ({self.count})'
+
+    class Meta:
+        ordering = ['-last_seen']
+
+
+class EventRollup(models.Model):
+    """Events inserted per hour, level and agent.
+
+    The environment is the agent's when the events were inserted. Rows of
+    deleted agents keep their agent id.
+    """
+    bucket = models.DateTimeField()
+    level = models.CharField(max_length=20, choices=Event.LEVEL_CHOICES)
+    agent = models.ForeignKey(
+        Agent, on_delete=models.DO_NOTHING, db_constraint=False,
+        null=True, blank=True, related_name='+'
+    )
+    environment = models.CharField(max_length=20, blank=True)
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.bucket} {self.level} {self.agent_id} ({self.count})'
+
+    class Meta:
+        ordering = ['bucket']
+        # NULL agents never conflict in a unique index, so they get their own
+        constraints = [
+            models.UniqueConstraint(
+                fields=['bucket', 'level', 'agent', 'environment'],
+                condition=models.Q(agent__isnull=False), name='unique_agent_rollup'
+            ),
+            models.UniqueConstraint(
+                fields=['bucket', 'level', 'environment'],
+                condition=models.Q(agent__isnull=True), name='unique_rollup_without_agent'
+            ),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """Response of a request sent with an Idempotency-Key header.
+
+    A row without status_code belongs to a request still being processed,
+    until locked_until: past it the worker is presumed dead and retries may
+    take the key over.
+    """
+    owner = models.CharField(max_length=64)
+    key = models.CharField(max_length=255)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.TextField(blank=True)
+    expires_at = models.DateTimeField(db_index=True)
+    locked_until = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f'{self.owner} {self.key}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'key'], name='unique_idempotency_key')
+        ]
+
+
+class QuotaBucket(models.Model):
+    """Tokens left in an ingestion quota bucket, shared by the workers.
+
+    `updated_at` is the unix time the tokens were last refilled.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    tokens = models.FloatField()
+    updated_at = models.FloatField()
+
+    def __str__(self):
+        return f'{self.key} ({self.tokens:.1f})'
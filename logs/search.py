@@ -0,0 +1,240 @@
+import re
+
+from django.db import OperationalError, connections, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+# Text search configuration of PostgreSQL: events mix languages, so words
+# are only lowercased, not stemmed
+SEARCH_CONFIG = 'simple'
+
+POSTGRESQL_FULL_TEXT = [
+    'ALTER TABLE logs_event ADD COLUMN IF NOT EXISTS search_vector tsvector',
+    'CREATE INDEX IF NOT EXISTS event_search_vector_idx ON logs_event USING GIN (search_vector)',
+    'DROP TRIGGER IF EXISTS logs_event_search_vector ON logs_event',
+    f"""CREATE TRIGGER logs_event_search_vector
+        BEFORE INSERT OR UPDATE OF description, details ON logs_event
+        FOR EACH ROW EXECUTE PROCEDURE
+        tsvector_update_trigger(search_vector, 'pg_catalog.{SEARCH_CONFIG}', description, details)""",
+    f"""UPDATE logs_event SET search_vector = to_tsvector(
+        '{SEARCH_CONFIG}', coalesce(description, '') || ' ' || coalesce(details, ''))""",
+]
+
+POSTGRESQL_DROP_FULL_TEXT = [
+    'DROP TRIGGER IF EXISTS logs_event_search_vector ON logs_event',
+    'ALTER TABLE logs_event DROP COLUMN IF EXISTS search_vector',
+]
+
+# External content table: the text is read from logs_event, the triggers
+# only keep the index up to date
+SQLITE_FULL_TEXT = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS logs_event_fts USING fts5(
+        description, details, content='logs_event', content_rowid='id')""",
+    """CREATE TRIGGER IF NOT EXISTS logs_event_fts_insert AFTER INSERT ON logs_event BEGIN
+        INSERT INTO logs_event_fts(rowid, description, details)
+        VALUES (new.id, new.description, new.details);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS logs_event_fts_delete AFTER DELETE ON logs_event BEGIN
+        INSERT INTO logs_event_fts(logs_event_fts, rowid, description, details)
+        VALUES ('delete', old.id, old.description, old.details);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS logs_event_fts_update
+    AFTER UPDATE OF description, details ON logs_event BEGIN
+        INSERT INTO logs_event_fts(logs_event_fts, rowid, description, details)
+        VALUES ('delete', old.id, old.description, old.details);
+        INSERT INTO logs_event_fts(rowid, description, details)
+        VALUES (new.id, new.description, new.details);
+    END""",
+    "INSERT INTO logs_event_fts(logs_event_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DROP_FULL_TEXT = [
+    'DROP TRIGGER IF EXISTS logs_event_fts_insert',
+    'DROP TRIGGER IF EXISTS logs_event_fts_delete',
+    'DROP TRIGGER IF EXISTS logs_event_fts_update',
+    'DROP TABLE IF EXISTS logs_event_fts',
+]
+
+# The GIN indexes match the UPPER(column::text) LIKE of icontains lookups
+POSTGRESQL_TRIGRAM = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    """CREATE INDEX IF NOT EXISTS agent_name_trgm_idx
+        ON logs_agent USING GIN (UPPER(name::text) gin_trgm_ops)""",
+    """CREATE INDEX IF NOT EXISTS event_description_trgm_idx
+        ON logs_event USING GIN (UPPER(description::text) gin_trgm_ops)""",
+]
+
+POSTGRESQL_DROP_TRIGRAM = [
+    'DROP INDEX IF EXISTS agent_name_trgm_idx',
+    'DROP INDEX IF EXISTS event_description_trgm_idx',
+]
+
+
+def sqlite_trigram(table, column):
+    index = f'{table}_trigram'
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5(
+            {column}, content='{table}', content_rowid='id', tokenize='trigram')""",
+        f"""CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {index}(rowid, {column}) VALUES (new.id, new.{column});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {index}({index}, rowid, {column}) VALUES ('delete', old.id, old.{column});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF {column} ON {table} BEGIN
+            INSERT INTO {index}({index}, rowid, {column}) VALUES ('delete', old.id, old.{column});
+            INSERT INTO {index}(rowid, {column}) VALUES (new.id, new.{column});
+        END""",
+        f"INSERT INTO {index}({index}) VALUES ('rebuild')",
+    ]
+
+
+SQLITE_TRIGRAM = sqlite_trigram('logs_event', 'description') + sqlite_trigram('logs_agent', 'name')
+
+SQLITE_DROP_TRIGRAM = [
+    f'DROP {kind} IF EXISTS {table}_trigram{suffix}'
+    for table in ['logs_event', 'logs_agent']
+    for kind, suffix in [('TRIGGER', '_insert'), ('TRIGGER', '_delete'), ('TRIGGER', '_update'), ('TABLE', '')]
+]
+
+# Triggers of the SQLite indexes, by their table
+SQLITE_TRIGGERS = {
+    table: {f'{table}_{operation}' for operation in ['insert', 'delete', 'update']}
+    for table in ['logs_event_fts', 'logs_event_trigram', 'logs_agent_trigram']
+}
+
+# Search indexes available on each database alias, found on first use
+available_indexes = {}
+
+
+def execute(connection, statements):
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def install(connection, postgresql, sqlite):
+    """Create search indexes, filled with the existing rows.
+
+    On SQLite builds without FTS5, or without its trigram tokenizer, nothing
+    is created and searches fall back to `icontains`.
+    """
+    available_indexes.pop(connection.alias, None)
+    if connection.vendor == 'postgresql':
+        execute(connection, postgresql)
+    elif connection.vendor == 'sqlite':
+        try:
+            with transaction.atomic(using=connection.alias):
+                execute(connection, sqlite)
+        except OperationalError:
+            pass  # no such module: fts5, or no such tokenizer: trigram
+
+
+def uninstall(connection, postgresql, sqlite):
+    available_indexes.pop(connection.alias, None)
+    if connection.vendor == 'postgresql':
+        execute(connection, postgresql)
+    elif connection.vendor == 'sqlite':
+        execute(connection, sqlite)
+
+
+def install_full_text(connection):
+    install(connection, POSTGRESQL_FULL_TEXT, SQLITE_FULL_TEXT)
+
+
+def uninstall_full_text(connection):
+    uninstall(connection, POSTGRESQL_DROP_FULL_TEXT, SQLITE_DROP_FULL_TEXT)
+
+
+def install_trigram(connection):
+    install(connection, POSTGRESQL_TRIGRAM, SQLITE_TRIGRAM)
+
+
+def uninstall_trigram(connection):
+    uninstall(connection, POSTGRESQL_DROP_TRIGRAM, SQLITE_DROP_TRIGRAM)
+
+
+def restore_search_indexes(sender, using, **kwargs):
+    """Recreate the SQLite triggers dropped when a migration remakes a table"""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+
+    indexes = search_indexes(connection)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        triggers = {name for name, in cursor.fetchall()}
+
+    missing = {table for table in indexes if not SQLITE_TRIGGERS[table] <= triggers}
+    if 'logs_event_fts' in missing:
+        install_full_text(connection)
+    if missing & {'logs_event_trigram', 'logs_agent_trigram'}:
+        install_trigram(connection)
+
+
+def search_indexes(connection):
+    """Names of the search indexes of the database"""
+    if connection.alias not in available_indexes:
+        if connection.vendor == 'postgresql':
+            columns = connection.introspection.get_table_description(connection.cursor(), 'logs_event')
+            indexes = {'search_vector'} & {column.name for column in columns}
+        elif connection.vendor == 'sqlite':
+            indexes = set(SQLITE_TRIGGERS) & set(connection.introspection.table_names())
+        else:
+            indexes = set()
+        available_indexes[connection.alias] = indexes
+    return available_indexes[connection.alias]
+
+
+def fts_string(term):
+    # Quoted as strings, so the terms are never read as FTS5 operators
+    return '"{}"'.format(term.replace('"', '""'))
+
+
+def full_text_search(queryset, terms):
+    """Filter events containing every word of terms in description or details"""
+    terms = [term for term in terms if re.search(r'\w', term)]
+    if not terms:
+        return queryset
+
+    indexes = search_indexes(connections[queryset.db])
+    if 'search_vector' in indexes:
+        matches = RawSQL(
+            'SELECT id FROM logs_event WHERE search_vector @@ plainto_tsquery(%s, %s)',
+            [SEARCH_CONFIG, ' '.join(terms)]
+        )
+    elif 'logs_event_fts' in indexes:
+        query = ' '.join(fts_string(term) for term in terms)
+        matches = RawSQL('SELECT rowid FROM logs_event_fts WHERE logs_event_fts MATCH %s', [query])
+    else:
+        for term in terms:
+            queryset = queryset.filter(Q(description__icontains=term) | Q(details__icontains=term))
+        return queryset
+
+    return queryset.filter(id__in=matches)
+
+
+# Field searched by substring, with its SQLite trigram index and the column
+# holding the ids of the indexed rows
+SUBSTRING_FIELDS = {
+    'description': ('logs_event_trigram', 'id'),
+    'agent__name': ('logs_agent_trigram', 'agent_id'),
+}
+
+
+def substring_search(queryset, field, terms):
+    """Filter events with every one of terms in field, as `icontains`.
+
+    PostgreSQL answers the lookups from the pg_trgm indexes. On SQLite terms
+    of three characters or more are matched in the trigram tables instead.
+    """
+    index, column = SUBSTRING_FIELDS[field]
+    indexed = index in search_indexes(connections[queryset.db])
+
+    for term in terms:
+        if indexed and len(term) >= 3:
+            matches = RawSQL(f'SELECT rowid FROM {index} WHERE {index} MATCH %s', [fts_string(term)])
+            queryset = queryset.filter(**{f'{column}__in': matches})
+        else:
+            queryset = queryset.filter(**{f'{field}__icontains': term})
+    return queryset
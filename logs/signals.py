@@ -0,0 +1,12 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from logs.ingestion import after_insert
+from logs.models import Event
+
+
+@receiver(post_save, sender=Event)
+def event_inserted(sender, instance, created, raw=False, **kwargs):
+    # Bulk inserts call after_insert themselves, bulk_create sends no signals
+    if created and not raw:
+        after_insert([instance])
@@ -0,0 +1,236 @@
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from django.utils.dateparse import parse_datetime
+
+from logs.models import Event
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('<Q')
+RECORD = struct.Struct('<II')
+
+
+def event_record(event):
+    """Return a JSON serializable dict with the columns of an unsaved Event"""
+    return {
+        'level': event.level,
+        'description': event.description,
+        'details': event.details,
+        'datetime': event.datetime.isoformat() if event.datetime else None,
+        'archived': event.archived,
+        'agent_id': event.agent_id,
+        'user_id': event.user_id,
+    }
+
+
+def event_from_record(record):
+    record = dict(record)
+    if record.get('datetime'):
+        record['datetime'] = parse_datetime(record['datetime'])
+    return Event(**record)
+
+
+class Segment:
+    """Append-only memory-mapped file of checksummed records.
+
+    The file starts with an 8 byte header holding the offset of the first
+    record not drained yet. Each record is its payload length and crc32
+    followed by the payload. The file is preallocated with zeros, so a zero
+    length marks the end of the written records. Data written to the map
+    survives a crash of the process, not of the machine.
+
+    The process using a segment holds an exclusive flock on it, which the
+    kernel releases when the process dies.
+    """
+
+    def __init__(self, path, size=None):
+        self.path = path
+        # New segments are allocated under a temporary name, so they are
+        # never seen unlocked by other processes
+        opened = path if size is None else f'{path}.tmp'
+        self.file = open(opened, 'r+b' if size is None else 'w+b')
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if size is not None:
+                self.file.truncate(size)
+            self.map = mmap.mmap(self.file.fileno(), 0)
+        except (OSError, ValueError):
+            self.file.close()
+            raise
+
+        if size is not None:
+            self.commit(HEADER.size)
+            os.rename(opened, path)
+
+        self.write_offset = HEADER.size
+        for offset, _ in self.records(HEADER.size):
+            self.write_offset = offset
+
+    @property
+    def drained(self):
+        return HEADER.unpack_from(self.map, 0)[0]
+
+    def commit(self, offset):
+        HEADER.pack_into(self.map, 0, offset)
+
+    def append(self, payload):
+        """Write payload, returning the offset after it or None if it is full"""
+        start = self.write_offset + RECORD.size
+        end = start + len(payload)
+        if end > len(self.map):
+            return None
+
+        # The length is written last, so a partial record is never read
+        self.map[start:end] = payload
+        RECORD.pack_into(
+            self.map, self.write_offset, len(payload), zlib.crc32(payload)
+        )
+        self.write_offset = end
+        return end
+
+    def records(self, offset):
+        """Yield (offset after the record, payload) starting at offset"""
+        while offset + RECORD.size <= len(self.map):
+            length, checksum = RECORD.unpack_from(self.map, offset)
+            start = offset + RECORD.size
+            payload = self.map[start:start + length]
+            if not length or len(payload) != length:
+                return
+            if zlib.crc32(payload) != checksum:
+                logger.error('Corrupted record at %d in %s', offset, self.path)
+                return
+
+            offset = start + length
+            yield offset, payload
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+class Spool:
+    """Directory of segments used as a write-ahead log of accepted events.
+
+    Segments that no process holds a lock on were left behind by a dead
+    process and are replayed by the next one calling `replay`.
+    """
+
+    def __init__(self, directory, segment_size):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.active = None
+        self.sealed = []
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def new_path(self):
+        return os.path.join(
+            self.directory, f'{time.time_ns()}-{os.getpid()}.spool'
+        )
+
+    def rotate(self, minimum_size):
+        if self.active is not None:
+            self.sealed.append(self.active)
+
+        size = max(self.segment_size, HEADER.size + minimum_size)
+        self.active = Segment(self.new_path(), size)
+
+    def append(self, record):
+        """Append a record, returning the position to commit once it is saved"""
+        payload = json.dumps(record).encode()
+        with self.lock:
+            offset = self.active and self.active.append(payload)
+            if not offset:
+                self.rotate(RECORD.size + len(payload))
+                offset = self.active.append(payload)
+            return self.active, offset
+
+    def commit(self, position):
+        """Mark every record up to position as drained"""
+        segment, offset = position
+        with self.lock:
+            segment.commit(offset)
+
+            while self.sealed and self.sealed[0] is not segment:
+                self.sealed.pop(0).remove()
+
+            if segment is not self.active and offset == segment.write_offset:
+                self.sealed.remove(segment)
+                segment.remove()
+
+    def claim(self, path):
+        """Open and lock an abandoned segment, or return None if it is in use"""
+        try:
+            segment = Segment(path)
+        except BlockingIOError:
+            return None  # Locked by a live process
+        except FileNotFoundError:
+            return None  # Already replayed by another process
+        except ValueError:
+            os.remove(path)  # Empty file
+            return None
+
+        try:
+            unlinked = os.stat(path).st_ino != os.fstat(segment.file.fileno()).st_ino
+        except FileNotFoundError:
+            unlinked = True
+
+        if unlinked:
+            segment.close()  # Replayed and removed while we were waiting
+            return None
+        return segment
+
+    def replay(self, insert, batch_size):
+        """Insert the undrained records left by dead processes.
+
+        If insert raises, the segment is released with the records inserted
+        so far drained, so a later replay resumes from there.
+        """
+        replayed = 0
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.spool'):
+                continue
+
+            segment = self.claim(os.path.join(self.directory, name))
+            if segment is None:
+                continue
+
+            try:
+                batch = []
+                for offset, payload in segment.records(segment.drained):
+                    batch.append(json.loads(payload))
+                    if len(batch) == batch_size:
+                        insert(batch)
+                        segment.commit(offset)
+                        replayed += len(batch)
+                        batch = []
+
+                if batch:
+                    insert(batch)
+                    replayed += len(batch)
+            except BaseException:
+                segment.close()
+                raise
+            segment.remove()
+
+        return replayed
+
+    def stats(self):
+        with self.lock:
+            return {
+                'directory': self.directory,
+                'segments': len(self.sealed) + (self.active is not None),
+            }
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import re
+import time
+
+from django.db import IntegrityError, close_old_connections
+from django.utils import timezone
+
+from logs.ingestion import insert_events
+from logs.models import Agent, Event
+
+logger = logging.getLogger(__name__)
+
+# Syslog severities 0 (Emergency) to 7 (Debug) mapped onto logs.models.LEVELS
+SEVERITY_LEVELS = [
+    'CRITICAL', 'CRITICAL', 'CRITICAL', 'ERROR',
+    'WARNING', 'INFO', 'INFO', 'DEBUG'
+]
+
+PRIORITY = re.compile(r'<(\d{1,3})>(.*)', re.S)
+RFC5424 = re.compile(
+    r'\d{1,2} (?P<timestamp>\S+) (?P<host>\S+) (?P<app>\S+) \S+ \S+ '
+    r'(?:-|(?:\[(?:[^\]\\]|\\.)*\])+) ?(?P<message>.*)', re.S
+)
+RFC3164 = re.compile(
+    r'[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d (?P<host>\S+) (?P<message>.*)', re.S
+)
+
+MAX_FRAME_SIZE = 64 * 1024
+
+
+def parse_message(data):
+    """Return (level, description) of a RFC 3164 or RFC 5424 message"""
+    text = data.decode('utf-8', 'replace').strip()
+
+    match = PRIORITY.match(text)
+    if not match or int(match.group(1)) > 191:
+        return 'INFO', text  # Without priority RFC 3164 assumes user.notice
+
+    severity = int(match.group(1)) % 8
+    message = match.group(2)
+
+    match = RFC5424.match(message)
+    if match:
+        app, message = match.group('app'), match.group('message')
+        if app != '-':
+            message = f'{app}: {message}'
+    else:
+        match = RFC3164.match(message)
+        if match:
+            message = match.group('message')
+
+    return SEVERITY_LEVELS[severity], message.strip() or text
+
+
+class SyslogCollector:
+    """Accumulate syslog messages and insert them as Event rows in batches.
+
+    A batch is written when it reaches `batch_size` messages or, at the
+    latest, every `flush_interval` seconds. Writes run in `executor`, so the
+    event loop keeps receiving while the database works.
+
+    One batch is written at a time and at most `max_pending` messages wait
+    for it; messages received beyond are dropped and counted. Batches that
+    fail are put back in front of the pending messages and retried on the
+    next flush, as EventBuffer does.
+    """
+
+    def __init__(self, batch_size, flush_interval, executor, agent_cache_ttl=60, max_pending=10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.executor = executor
+        self.agent_cache_ttl = agent_cache_ttl
+        self.max_pending = max_pending
+
+        self.pending = []
+        self.writing = None
+        self.agents = {}
+        self.agents_loaded_at = time.monotonic()
+
+        self.received = 0
+        self.inserted = 0
+        self.dropped = 0
+
+    def add(self, data, host):
+        self.received += 1
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+
+        level, description = parse_message(data)
+        self.pending.append((host, level, description, data, timezone.now()))
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Start writing the next batch, returning the future of the write.
+
+        While a batch is being written, its future is returned instead.
+        """
+        if self.writing is not None or not self.pending:
+            return self.writing
+
+        batch = self.pending[:self.batch_size]
+        del self.pending[:self.batch_size]
+        loop = asyncio.get_event_loop()
+        self.writing = loop.run_in_executor(self.executor, self.insert, batch)
+
+        def written(future):
+            self.writing = None
+            if not future.result():
+                self.pending[:0] = batch
+                overflow = len(self.pending) - self.max_pending
+                if overflow > 0:
+                    del self.pending[-overflow:]
+                    self.dropped += overflow
+            elif len(self.pending) >= self.batch_size:
+                self.flush()
+
+        self.writing.add_done_callback(written)
+        return self.writing
+
+    async def drain(self):
+        """Write the pending messages, stopping at the first failed write"""
+        while self.pending or self.writing is not None:
+            if not await self.flush():
+                return
+
+    def resolve_agents(self, hosts):
+        """Map sender addresses to Agent ids, querying only unknown ones"""
+        if time.monotonic() - self.agents_loaded_at > self.agent_cache_ttl:
+            self.agents, self.agents_loaded_at = {}, time.monotonic()
+
+        missing = set(hosts) - set(self.agents)
+        if missing:
+            self.agents.update(dict.fromkeys(missing))
+            found = Agent.objects.filter(address__in=missing).order_by('-id')
+            for agent_id, address in found.values_list('id', 'address'):
+                self.agents[address] = agent_id
+
+        return self.agents
+
+    def insert(self, batch):
+        """Insert a batch, returning False if it must be retried"""
+        try:
+            agents = self.resolve_agents(host for host, *_ in batch)
+            events = [
+                Event(
+                    level=level, description=description,
+                    details=data.decode('utf-8', 'replace'),
+                    datetime=received_at, agent_id=agents.get(host)
+                )
+                for host, level, description, data, received_at in batch
+            ]
+            insert_events(events)
+            self.inserted += len(events)
+            return True
+        except Exception as exc:
+            if isinstance(exc, IntegrityError):
+                self.agents = {}  # A cached agent was deleted, retries resolve the hosts again
+            logger.exception('Could not insert %d syslog messages, retrying them', len(batch))
+            return False
+        finally:
+            close_old_connections()
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+
+class SyslogUDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, collector):
+        self.collector = collector
+
+    def datagram_received(self, data, addr):
+        self.collector.add(data, addr[0])
+
+
+class SyslogTCPProtocol(asyncio.Protocol):
+    """Split a TCP stream with octet counting or newline framing (RFC 6587)"""
+
+    def __init__(self, collector):
+        self.collector = collector
+        self.buffer = b''
+
+    def connection_made(self, transport):
+        self.host = transport.get_extra_info('peername')[0]
+
+    def data_received(self, data):
+        self.buffer += data
+        while self.buffer:
+            frame = self.next_frame()
+            if frame is None:
+                break
+            if frame.strip():
+                self.collector.add(frame, self.host)
+
+        if len(self.buffer) > MAX_FRAME_SIZE:
+            self.collector.add(self.buffer, self.host)
+            self.buffer = b''
+
+    def next_frame(self):
+        length, space, rest = self.buffer.partition(b' ')
+        if space and length.isdigit():
+            size = int(length)
+            if len(rest) < size:
+                return None
+            frame, self.buffer = rest[:size], rest[size:]
+            return frame
+
+        frame, newline, rest = self.buffer.partition(b'\n')
+        if not newline:
+            return None
+        self.buffer = rest
+        return frame
+
+    def eof_received(self):
+        if self.buffer.strip():
+            self.collector.add(self.buffer, self.host)
+        self.buffer = b''
@@ -1,7 +1,22 @@
+import asyncio
+import io
+import json
+import os
+import tempfile
+from concurrent.futures import Future
+from datetime import timedelta
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import IntegrityError, connection
 from django.test import TestCase
 from django.utils import timezone
 
-from logs.models import User, Agent, Event
+from logs.ingestion import insert_events
+from logs.models import User, Agent, Event, EventGroup, EventRollup
+from logs.buffer import EventBuffer, start_spool_replay
+from logs.spool import Spool
+from logs.syslog import SyslogCollector, SyslogTCPProtocol, parse_message
 
 class ModelsTestCase(TestCase):
     def create_user(self, name):
@@ -99,3 +114,353 @@ class ModelsTestCase(TestCase):
 
         for username, event in events:
             self.assertEqual(username, event.collected_by)
+
+
+class SpoolTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def files(self):
+        return sorted(os.listdir(self.directory.name))
+
+    def crash(self, spool):
+        """Release the segments of spool without draining them"""
+        for segment in spool.sealed + [spool.active]:
+            segment.close()
+
+    def test_segments_rotate_and_are_removed_when_drained(self):
+        spool = Spool(self.directory.name, segment_size=64)
+        positions = [spool.append({'n': i, 'text': 'x' * 20}) for i in range(3)]
+
+        self.assertEqual(3, len(self.files()))
+        self.assertEqual(3, spool.stats().get('segments'))
+
+        spool.commit(positions[0])
+        self.assertEqual(2, len(self.files()))
+
+        spool.commit(positions[2])
+        self.assertEqual(1, len(self.files()))
+        self.assertEqual(positions[2][0].path, os.path.join(self.directory.name, self.files()[0]))
+
+    def test_undrained_records_are_replayed(self):
+        spool = Spool(self.directory.name, segment_size=64)
+        positions = [spool.append({'n': i}) for i in range(5)]
+        spool.commit(positions[1])
+
+        replayed = []
+        with self.subTest('Segments in use must not be replayed'):
+            self.assertEqual(0, Spool(self.directory.name, 64).replay(replayed.extend, 2))
+            self.assertEqual([], replayed)
+
+        self.crash(spool)
+        with self.subTest('Records after the drained offset must be replayed'):
+            self.assertEqual(3, Spool(self.directory.name, 64).replay(replayed.extend, 2))
+            self.assertEqual([{'n': 2}, {'n': 3}, {'n': 4}], replayed)
+            self.assertEqual([], self.files())
+
+    def test_failed_replays_are_resumed(self):
+        spool = Spool(self.directory.name, segment_size=1024)
+        for i in range(5):
+            spool.append({'n': i})
+        self.crash(spool)
+
+        replayed = []
+
+        def insert(batch):
+            if len(replayed) == 2:
+                raise ConnectionError('database is down')
+            replayed.extend(batch)
+
+        with self.subTest('Failed segments must be released'):
+            self.assertRaises(ConnectionError, Spool(self.directory.name, 1024).replay, insert, 2)
+            self.assertEqual(1, len(self.files()))
+
+        replayed.append('retry')
+        with self.subTest('Replays must resume after the inserted records'):
+            self.assertEqual(3, Spool(self.directory.name, 1024).replay(insert, 2))
+            self.assertEqual([{'n': 0}, {'n': 1}, 'retry', {'n': 2}, {'n': 3}, {'n': 4}], replayed)
+            self.assertEqual([], self.files())
+
+    def test_corrupted_records_are_not_replayed(self):
+        spool = Spool(self.directory.name, segment_size=1024)
+        spool.append({'n': 1})
+        segment, offset = spool.append({'n': 2})
+        segment.map[offset - 2] ^= 0xFF
+        self.crash(spool)
+
+        replayed = []
+        Spool(self.directory.name, 1024).replay(replayed.extend, 10)
+        self.assertEqual([{'n': 1}], replayed)
+
+    def test_buffered_events_are_spooled_until_inserted(self):
+        spool = Spool(self.directory.name, segment_size=1024)
+        buffer = EventBuffer(maxsize=10, batch_size=10, flush_interval=1, spool=spool)
+        event = Event(level='INFO', description='spooled', details='spooled')
+
+        buffer.put(event)
+        segment = spool.active
+        with self.subTest('Event must be in the spool'):
+            records = list(segment.records(segment.drained))
+            self.assertEqual(1, len(records))
+
+        buffer.flush()
+        with self.subTest('Event must be inserted and drained from the spool'):
+            self.assertEqual(1, Event.objects.filter(description='spooled').count())
+            self.assertEqual([], list(segment.records(segment.drained)))
+
+        buffer.put(Event(level='ERROR', description='replayed', details='replayed'))
+        self.crash(spool)
+        replaying = EventBuffer(
+            maxsize=10, batch_size=10, flush_interval=1,
+            spool=Spool(self.directory.name, 1024)
+        )
+        with mock.patch('logs.buffer.insert_events', side_effect=ConnectionError('database is down')), \
+                self.assertLogs('logs.buffer', 'ERROR'):
+            replaying.replay()
+        with self.subTest('Failed replays must be retried', files=self.files()):
+            self.assertTrue(replaying.replay_pending)
+            self.assertEqual(0, Event.objects.filter(description='replayed').count())
+
+        replaying.replay()
+        with self.subTest('Events of a dead buffer must be replayed'):
+            self.assertFalse(replaying.replay_pending)
+            self.assertEqual(1, replaying.replayed)
+            self.assertEqual(1, Event.objects.filter(description='replayed').count())
+
+    def test_buffer_thread_starts_on_first_event(self):
+        buffer = EventBuffer(maxsize=10, batch_size=10, flush_interval=1, autostart=True)
+        with mock.patch.object(buffer, 'start') as start:
+            self.assertFalse(buffer.stats().get('running'))
+            buffer.put(Event(level='INFO', description='first', details='first'))
+            start.assert_called_once_with()
+
+    def test_serving_processes_replay_the_spool(self):
+        buffer = EventBuffer(maxsize=10, batch_size=10, flush_interval=1, autostart=True)
+        with mock.patch('logs.buffer.event_buffer', buffer), mock.patch.object(buffer, 'start') as start:
+            start_spool_replay()
+            start.assert_not_called()
+
+            buffer.spool = Spool(self.directory.name, 1024)
+            start_spool_replay()
+            start.assert_called_once_with()
+
+
+class SyslogTestCase(TestCase):
+    def test_severities_are_mapped_onto_levels(self):
+        messages = [
+            ('CRITICAL', b'<0>kernel panic'),
+            ('CRITICAL', b'<10>disk failure'),
+            ('ERROR', b'<11>request failed'),
+            ('WARNING', b'<12>disk almost full'),
+            ('INFO', b'<13>user logged in'),
+            ('INFO', b'<14>user logged out'),
+            ('DEBUG', b'<15>cache miss'),
+            ('INFO', b'no priority'),
+        ]
+        for level, message in messages:
+            self.assertEqual(level, parse_message(message)[0])
+
+    def test_message_headers_are_removed_from_description(self):
+        messages = [
+            ('sshd[42]: accepted key', b'<38>Oct 11 22:14:15 server sshd[42]: accepted key'),
+            ('app: timeout', b'<11>1 2003-10-11T22:14:15.003Z host app 42 ID47 - timeout'),
+            ('app: started', b'<14>1 2003-10-11T22:14:15Z host app - - [meta x="1"] started'),
+        ]
+        for description, message in messages:
+            self.assertEqual(description, parse_message(message)[1])
+
+    def test_batches_resolve_agents_by_address(self):
+        agent = Agent.objects.create(environment='production', name='legacy', address='10.0.0.1')
+        collector = SyslogCollector(batch_size=10, flush_interval=1, executor=None)
+
+        now = timezone.now()
+        collector.insert([
+            ('10.0.0.1', 'ERROR', 'failed', b'<11>failed', now),
+            ('10.0.0.2', 'INFO', 'unknown', b'<14>unknown', now),
+        ])
+
+        self.assertEqual(2, collector.inserted)
+        self.assertEqual(agent, Event.objects.get(description='failed').agent)
+        self.assertIsNone(Event.objects.get(description='unknown').agent)
+        self.assertEqual('<11>failed', Event.objects.get(description='failed').details)
+
+    def test_failed_batches_are_retried(self):
+        class InlineExecutor:
+            def submit(self, function, *args):
+                future = Future()
+                future.set_result(function(*args))
+                return future
+
+        collector = SyslogCollector(batch_size=2, flush_interval=1, executor=InlineExecutor(), max_pending=3)
+        written = []
+
+        async def receive():
+            with mock.patch.object(collector, 'insert', return_value=False):
+                for i in range(4):
+                    collector.add(f'<11>message {i}'.encode(), '10.0.0.1')
+                self.assertFalse(await collector.writing)
+            with self.subTest('Failed batches must wait in front of the new messages'):
+                self.assertEqual(['message 0', 'message 1', 'message 2'], [m[2] for m in collector.pending])
+                self.assertEqual(1, collector.dropped)
+
+            with mock.patch.object(collector, 'insert', side_effect=lambda batch: written.append(batch) or True):
+                await collector.drain()
+
+        asyncio.run(receive())
+        with self.subTest('Pending messages must be written in batches'):
+            self.assertEqual([['message 0', 'message 1'], ['message 2']], [[m[2] for m in b] for b in written])
+            self.assertEqual([], collector.pending)
+
+        now = timezone.now()
+        collector.agents = {'10.0.0.1': 0}
+        with mock.patch('logs.syslog.insert_events', side_effect=IntegrityError('FOREIGN KEY constraint failed')), \
+                self.assertLogs('logs.syslog', 'ERROR'):
+            inserted = collector.insert([('10.0.0.1', 'ERROR', 'failed', b'<11>failed', now)])
+        with self.subTest('Failed inserts must be retried with the agents resolved again'):
+            self.assertFalse(inserted)
+            self.assertEqual({}, collector.agents)
+
+    def test_one_batch_is_written_at_a_time(self):
+        executor = mock.Mock()
+        executor.submit.return_value = Future()
+        collector = SyslogCollector(batch_size=2, flush_interval=1, executor=executor)
+
+        async def receive():
+            for i in range(5):
+                collector.add(b'<14>waiting', '10.0.0.1')
+            collector.flush()
+
+        asyncio.run(receive())
+        self.assertEqual(1, executor.submit.call_count)
+        self.assertEqual(3, len(collector.pending))
+
+    def test_tcp_stream_is_split_in_frames(self):
+        received = []
+
+        class Collector:
+            def add(self, data, host):
+                received.append((data, host))
+
+        protocol = SyslogTCPProtocol(Collector())
+        protocol.host = '10.0.0.1'
+        protocol.data_received(b'<14>first\n<14>sec')
+        protocol.data_received(b'ond\n11 <11>counted12')
+        protocol.eof_received()
+
+        frames = [data for data, host in received]
+        self.assertEqual([b'<14>first', b'<14>second', b'<11>counted', b'12'], frames)
+
+
+class ImportEventsTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.agent = Agent.objects.create(environment='production', name='legacy')
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def import_events(self, *paths, **options):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_events', *paths, stdout=stdout, stderr=stderr, **options)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_csv_and_ndjson_rows_are_imported(self):
+        csv_path = self.write('events.csv', (
+            'level,description,details,datetime,archived,agent\n'
+            f'ERROR,disk full,"line 1\nline 2",2020-07-01T10:00:00Z,true,{self.agent.id}\n'
+            'INFO,started,details,,,\n'
+        ))
+        ndjson_path = self.write('events.ndjson', '\n'.join([
+            json.dumps({'level': 'ERROR', 'description': 'disk full', 'details': 'again', 'agent': self.agent.id}),
+            json.dumps({'level': 'DEBUG', 'description': 'tick', 'details': 'tick'}),
+        ]))
+
+        stdout, stderr = self.import_events(csv_path, ndjson_path, workers=0)
+
+        self.assertIn('Imported 4 events (0 invalid)', stdout)
+        self.assertIn('rows/s', stdout)
+        event = Event.objects.get(details='line 1\nline 2')
+        self.assertTrue(event.archived)
+        self.assertEqual(self.agent, event.agent)
+        self.assertEqual(2020, event.datetime.year)
+        self.assertIsNone(Event.objects.get(description='started').datetime)
+        self.assertEqual(2, EventGroup.objects.get(description='disk full').count)
+
+    def test_invalid_rows_are_reported(self):
+        path = self.write('events.ndjson', '\n'.join([
+            json.dumps({'level': 'INFO', 'description': 'valid', 'details': 'valid'}),
+            json.dumps({'level': 'NOTICE', 'description': '', 'details': 'x'}),
+            json.dumps({'level': 'INFO', 'description': 'x', 'details': 'x', 'agent': 999}),
+            '{not json',
+        ]))
+
+        stdout, stderr = self.import_events(path, workers=1, batch_size=2)
+
+        self.assertIn('Imported 1 events (3 invalid)', stdout)
+        self.assertIn(f'{path}:2:', stderr)
+        self.assertIn('level', stderr.splitlines()[0])
+        self.assertIn('does not exist', stderr)
+        self.assertIn(f'{path}:4:', stderr)
+        self.assertEqual(['valid'], list(Event.objects.values_list('description', flat=True)))
+
+
+class ExplainEventQueriesTestCase(TestCase):
+    def test_plans_are_shown_with_and_without_indexes(self):
+        stdout = io.StringIO()
+        call_command('explain_event_queries', stdout=stdout)
+
+        with_indexes, without_indexes = stdout.getvalue().split('Without indexes')
+        self.assertIn('event_archived_datetime_idx', with_indexes)
+        self.assertNotIn('event_archived_datetime_idx', without_indexes)
+
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Event._meta.db_table)
+        self.assertIn('event_archived_datetime_idx', constraints)
+        with self.subTest('The agent foreign key must use the agent and datetime index'):
+            indexes = [c['columns'] for c in constraints.values() if c['index'] and not c['primary_key']]
+            self.assertIn(['agent_id', 'datetime'], indexes)
+            self.assertNotIn(['agent_id'], indexes)
+
+
+class EventRollupTestCase(TestCase):
+    def setUp(self):
+        self.agent = Agent.objects.create(environment='production', name='api')
+        self.hour = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=5)
+
+    def rollups(self):
+        return sorted(EventRollup.objects.values_list('bucket', 'level', 'agent', 'environment', 'count'))
+
+    def test_inserted_events_are_counted_per_hour(self):
+        at = self.hour + timedelta(minutes=10)
+        later = self.hour + timedelta(hours=1, minutes=59)
+        insert_events([
+            Event(level='ERROR', description='a', details='a', datetime=at, agent_id=self.agent.id),
+            Event(level='ERROR', description='b', details='b', datetime=at, agent=self.agent),
+            Event(level='ERROR', description='c', details='c', datetime=later, agent=self.agent),
+            Event(level='INFO', description='d', details='d', datetime=at),
+            Event(level='INFO', description='e', details='e'),
+        ])
+        Event.objects.create(level='INFO', description='f', details='f', datetime=at)
+        Event.objects.create(level='ERROR', description='g', details='g', datetime=at, agent=self.agent)
+
+        expected = [
+            (self.hour, 'ERROR', self.agent.id, 'production', 3),
+            (self.hour, 'INFO', None, '', 2),
+            (self.hour + timedelta(hours=1), 'ERROR', self.agent.id, 'production', 1),
+        ]
+        self.assertEqual(expected, self.rollups())
+
+        stdout = io.StringIO()
+        EventRollup.objects.update(count=0)
+        call_command('backfill_event_rollups', stdout=stdout)
+        self.assertIn('3 rollups deleted, 3 created', stdout.getvalue())
+        self.assertEqual(expected, self.rollups())
+
+        Event.objects.filter(datetime=later).delete()
+        call_command('backfill_event_rollups', since=later.isoformat(), stdout=stdout)
+        self.assertEqual(expected[:2], self.rollups())